@@ -0,0 +1,131 @@
+"""
+Numba kernels for Maximal Marginal Relevance.
+
+NumPy MMR issues one GEMV plus a handful of vector ops per selected item,
+and for the usual 20-50 candidate shortlist that dispatch overhead is most
+of its runtime. The fused loops below avoid it: a serial kernel for
+ordinary pools and a parallel one that spreads the similarity update over
+all cores once the pool is large enough to amortize the thread fan-out.
+Numba is an optional dependency: when it is not installed `is_available`
+returns False and chat.retrieval keeps using the NumPy implementation.
+"""
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # pragma: no cover - optional dependency
+    njit = None
+
+# Below this pool size waking the thread pool costs more than it saves
+PARALLEL_MIN_CANDIDATES = 2000
+
+# Only the flags that let LLVM vectorize the dot products; the full
+# fastmath set assumes no infinities or NaNs and may fold comparisons
+FASTMATH = {'contract', 'reassoc'}
+# Below any cosine similarity (and any MMR score), so used instead of -inf
+_SENTINEL = -2.0
+
+
+def is_available() -> bool:
+    """Return True if numba can be imported."""
+    return njit is not None
+
+
+if njit is not None:
+    @njit(fastmath=FASTMATH, cache=True)
+    def _next_best(relevance, max_sim, selected, lambda_param):
+        # Strict > keeps the lowest index on ties, like np.argmax
+        best = -1
+        best_score = _SENTINEL
+        for i in range(len(relevance)):
+            if not selected[i]:
+                score = lambda_param * relevance[i] - (1.0 - lambda_param) * max_sim[i]
+                if best == -1 or score > best_score:
+                    best = i
+                    best_score = score
+        return best
+
+    @njit(fastmath=FASTMATH, cache=True)
+    def _mmr(candidates, relevance, lambda_param, top_k, out):
+        n, dim = candidates.shape
+        max_sim = np.full(n, _SENTINEL, dtype=np.float32)
+        selected = np.zeros(n, dtype=np.bool_)
+        best = np.argmax(relevance)
+
+        for step in range(top_k):
+            out[step] = best
+            selected[best] = True
+            if step + 1 == top_k:
+                break
+
+            # Fold the newest selection into each candidate's running max similarity
+            for i in range(n):
+                sim = np.float32(0.0)
+                for j in range(dim):
+                    sim += candidates[i, j] * candidates[best, j]
+                if sim > max_sim[i]:
+                    max_sim[i] = sim
+
+            best = _next_best(relevance, max_sim, selected, lambda_param)
+        return out
+
+    @njit(parallel=True, fastmath=FASTMATH, cache=True)
+    def _mmr_parallel(candidates, relevance, lambda_param, top_k, out):
+        n, dim = candidates.shape
+        max_sim = np.full(n, _SENTINEL, dtype=np.float32)
+        selected = np.zeros(n, dtype=np.bool_)
+        best = np.argmax(relevance)
+
+        for step in range(top_k):
+            out[step] = best
+            selected[best] = True
+            if step + 1 == top_k:
+                break
+
+            for i in prange(n):
+                sim = np.float32(0.0)
+                for j in range(dim):
+                    sim += candidates[i, j] * candidates[best, j]
+                if sim > max_sim[i]:
+                    max_sim[i] = sim
+
+            best = _next_best(relevance, max_sim, selected, lambda_param)
+        return out
+
+
+def mmr(candidates: np.ndarray, relevance_scores: np.ndarray, lambda_param: float, top_k: int) -> np.ndarray:
+    """
+    Select top_k candidate indices by MMR.
+
+    Args:
+        candidates: Unit-length candidate embeddings, float32 (N, D)
+        relevance_scores: Query/candidate cosine scores, shape (N,)
+        lambda_param: Trade-off between relevance (1.0) and diversity (0.0)
+        top_k: Number of indices to select (at most N)
+
+    Returns:
+        int64 array of selected indices in selection order
+    """
+    out = np.empty(top_k, dtype=np.int64)
+    if top_k == 0:
+        return out
+    kernel = _mmr_parallel if len(candidates) >= PARALLEL_MIN_CANDIDATES else _mmr
+    return kernel(
+        np.ascontiguousarray(candidates, dtype=np.float32),
+        np.ascontiguousarray(relevance_scores, dtype=np.float32),
+        np.float32(lambda_param),
+        top_k,
+        out,
+    )
+
+
+def warm_up() -> None:
+    """
+    Compile (or load the cached) kernels so the first request does not pay
+    for it. Called by the WSGI/ASGI entry points, not on every app load,
+    so management commands and tests skip the compile.
+    """
+    if is_available():
+        args = (np.eye(2, dtype=np.float32), np.ones(2, dtype=np.float32), np.float32(0.5), 2)
+        _mmr(*args, np.empty(2, dtype=np.int64))
+        _mmr_parallel(*args, np.empty(2, dtype=np.int64))
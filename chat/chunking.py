@@ -1,11 +1,40 @@
-import textwrap
+from typing import Iterable, Iterator, Union
+
+
+def _iter_lines(text: str) -> Iterator[str]:
+    """Yield the lines of text one at a time, without splitting it all up front."""
+    start = 0
+    while (end := text.find("\n", start)) != -1:
+        yield text[start:end]
+        start = end + 1
+    yield text[start:]
+
+
+def iter_chunks(text: Union[str, Iterable[str]], max_len: int = 500):
+    """
+    Yield chunks of at most max_len characters, split on word boundaries.
+
+    Takes a string or any iterable of lines (such as an open text file), and
+    reads one paragraph at a time, so only the current line is ever copied.
+    """
+    lines = _iter_lines(text) if isinstance(text, str) else text
+    for para in lines:
+        para = para.strip()
+        start, end = 0, len(para)
+        while end - start > max_len:
+            # Last space inside the window; hard-break words longer than max_len
+            cut = para.rfind(" ", start, start + max_len + 1)
+            if cut <= start:
+                cut = start + max_len
+            piece = para[start:cut].rstrip()
+            if piece:
+                yield piece
+            start = cut
+            while start < end and para[start] == " ":
+                start += 1
+        if start < end:
+            yield para[start:]
 
 def chunk_text(text: str, max_len: int = 500):
     """Split text into roughly equal chunks."""
-    paragraphs = [p.strip() for p in text.split("\n") if p.strip()]
-    chunks = []
-    for para in paragraphs:
-        parts = textwrap.wrap(para, width=max_len)
-        chunks.extend(parts)
-    return chunks
-
+    return list(iter_chunks(text, max_len))
@@ -0,0 +1,44 @@
+"""
+Cache of each session's recent message window.
+
+Entries are keyed on the session's updated_at, which every write path bumps
+together with its message changes (ChatViewSet.send, chat_stream, the upload
+reset, summarization, and the ChatMessage post_save signal). A session that
+has moved on simply misses, so no invalidation has to reach other workers
+and the window stays consistent on any Django cache backend: per-process
+LocMem, or Redis when REDIS_URL is set.
+"""
+from typing import List, Tuple
+
+from django.core.cache import cache
+
+from chat.models import ChatMessage
+
+CONTEXT_WINDOW = 20
+CONTEXT_TTL = 3600
+
+
+def _key(session) -> str:
+    return f"ctx:{session.pk}:{session.updated_at.timestamp()}"
+
+
+def get_recent_messages(session) -> List[Tuple[str, str, int]]:
+    """
+    Return the session's newest messages, newest first.
+
+    Args:
+        session: ChatSession with updated_at loaded
+
+    Returns:
+        Up to CONTEXT_WINDOW (role, content, token_count) tuples
+    """
+    key = _key(session)
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            ChatMessage.objects.filter(session_id=session.pk)
+            .order_by('-created_at')
+            .values_list('role', 'content', 'token_count')[:CONTEXT_WINDOW]
+        )
+        cache.set(key, rows, CONTEXT_TTL)
+    return rows
@@ -1,13 +1,119 @@
+from functools import lru_cache
+from hashlib import blake2b
+
 import numpy as np
+import torch
+from django.core.cache import cache
 from sentence_transformers import SentenceTransformer
 
-model = SentenceTransformer("all-MiniLM-L6-v2")
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Larger batches only pay off when the forward pass runs on a GPU.
+DEFAULT_BATCH_SIZE = 256 if DEVICE == "cuda" else 64
+
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+model = SentenceTransformer(MODEL_NAME, device=DEVICE)
+if DEVICE == "cuda":
+    # FP16 halves memory traffic; cosine scores are unaffected at this precision.
+    model.half()
+
+QUERY_EMBEDDING_TTL = 3600
 
 def embed_text(text: str):
-    """Return a list embedding for given text."""
-    return model.encode([text])[0].tolist()
+    """Return a unit-length list embedding for given text."""
+    return model.encode([text], normalize_embeddings=True)[0].tolist()
+
+@lru_cache(maxsize=4096)
+def embed_query(text: str):
+    """
+    Return a read-only float32 embedding for a search query.
+
+    Cached per process and in Django's cache (shared across workers), so
+    retries and repeated questions skip the forward pass. Whitespace is
+    collapsed first (the tokenizer ignores it anyway) and vectors are cached
+    as raw float32 bytes, which avoids pickling a list of Python floats.
+    The key includes the model name, so switching models never serves
+    vectors from the old embedding space.
+    """
+    text = " ".join(text.split())
+    key = f"emb:{MODEL_NAME}:" + blake2b(text.encode(), digest_size=16).hexdigest()
+    raw = cache.get(key)
+    if raw is None:
+        raw = np.asarray(embed_text(text), dtype=np.float32).tobytes()
+        cache.set(key, raw, QUERY_EMBEDDING_TTL)
+    return np.frombuffer(raw, dtype=np.float32)
+
+def embed_texts(texts, batch_size: int = DEFAULT_BATCH_SIZE):
+    """
+    Embed many texts in batched forward passes.
+
+    Returns a float32 (N, D) array of L2-normalized embeddings. SentenceTransformer
+    sorts inputs by length internally, so each batch carries minimal padding.
+    Repeated texts (boilerplate headers, duplicated sections) are encoded once.
+    """
+    texts = list(texts)
+    unique = list(dict.fromkeys(texts))
+    embeddings = model.encode(
+        unique,
+        batch_size=batch_size,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+    ).astype(np.float32, copy=False)
+    if len(unique) == len(texts):
+        return embeddings
+    positions = {text: i for i, text in enumerate(unique)}
+    return embeddings[[positions[text] for text in texts]]
+
+def stack_embeddings(embeddings):
+    """Stack stored (already unit-length) embeddings into a contiguous float32 (N, D) matrix."""
+    return np.array(embeddings, dtype=np.float32, ndmin=2)
+
+# Rows widened to float32 per GEMV in int8_scores; a block stays cache-resident
+# instead of materializing a float32 copy of the whole int8 matrix.
+INT8_SCORE_BLOCK = 512
+
+def int8_scores(q, codes, scales):
+    """Approximate cosine scores of `q` against int8-quantized unit rows (an (N, D) int8 matrix or N byte strings)."""
+    if isinstance(codes, np.ndarray):
+        matrix = codes
+    else:
+        matrix = np.frombuffer(b"".join(codes), dtype=np.int8).reshape(len(codes), -1)
+    q = np.asarray(q, dtype=np.float32)
+    q_norm = np.linalg.norm(q)
+    if q_norm:
+        q = q / q_norm
+    q = (q / 127.0).astype(np.float32)
+    scores = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), INT8_SCORE_BLOCK):
+        block = matrix[start:start + INT8_SCORE_BLOCK]
+        np.matmul(block.astype(np.float32), q, out=scores[start:start + len(block)])
+    scores *= np.asarray(scales, dtype=np.float32)
+    return scores
+
+def to_unit_matrix(embeddings):
+    """Stack embeddings into a contiguous float32 (N, D) matrix with L2-normalized rows."""
+    matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+def cosine_similarity_batch(q, M):
+    """Score query `q` against every row of the L2-normalized matrix `M` with one GEMV."""
+    q = np.asarray(q, dtype=np.float32)
+    q_norm = np.linalg.norm(q)
+    if q_norm:
+        q = q / q_norm
+    return M @ q
 
 def cosine_similarity(a, b):
-    a, b = np.array(a), np.array(b)
-    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+    """Cosine similarity of two vectors (0.0 if either is all zeros)."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a, b) / denom) if denom else 0.0
 
+def dot_normalized(a, b):
+    """Fast cosine similarity for vectors the caller knows are already unit-length (a bare dot product)."""
+    return float(np.dot(a, b))
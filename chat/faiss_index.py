@@ -0,0 +1,463 @@
+"""
+FAISS vector index over DocumentChunk embeddings.
+
+Vectors are L2-normalized before they are added, so inner-product search
+returns cosine similarity. Each chunk UUID is mapped to an int64 label in
+an IndexIDMap2, which lets single chunks be added or removed as rows change
+(see chat.signals), and labels are grouped by document so a search can be
+restricted to some documents without listing their chunks.
+
+The index lives in each process's memory. It is only written to disk by a
+single writer (the ingest_docs command); a worker loads that file, or
+builds the index from the database, on first use, and picks up documents
+added since (for example by another worker) from the database the first
+time a search asks for them. FAISS is an optional dependency: when it is
+not installed `search` returns None and the caller falls back to the
+NumPy scan in chat.retrieval.
+"""
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import faiss
+except ImportError:  # pragma: no cover - optional dependency
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 384
+
+# IVF256 needs ~39 training points per centroid; below that an exact flat
+# scan is fast enough. Quantizers trained on a handful of vectors are poor,
+# so no trained index is built from fewer than MIN_TRAIN_VECTORS.
+FLAT_FACTORY = "Flat"
+IVF_PQ_FACTORY = "IVF256,PQ32"
+IVF_PQ_MIN_VECTORS = 256 * 39
+MIN_TRAIN_VECTORS = 1000
+IVF_NPROBE = 16
+HNSW_EF_SEARCH = 64
+
+
+class _ReadWriteLock:
+    """
+    Lets any number of searches run at once (FAISS search is thread-safe)
+    while index mutations run alone. Waiting writers block new readers, so
+    a steady stream of searches cannot starve them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+
+_lock = _ReadWriteLock()
+_index = None
+_labels: Dict[uuid.UUID, int] = {}
+_chunk_ids: Dict[int, uuid.UUID] = {}
+_label_documents: Dict[int, uuid.UUID] = {}
+_documents: Dict[uuid.UUID, Set[int]] = {}
+_next_label = 0
+_loaded = False
+_retrain_pending = False
+
+
+def is_available() -> bool:
+    """Return True if the faiss package can be imported."""
+    return faiss is not None
+
+
+def _index_path() -> Path:
+    return Path(settings.RAG_CONFIG['faiss_index_path'])
+
+
+def _ids_path() -> Path:
+    return _index_path().with_suffix('.ids.npz')
+
+
+def _normalized(embeddings) -> np.ndarray:
+    xb = np.ascontiguousarray(np.array(embeddings, dtype=np.float32, ndmin=2))
+    faiss.normalize_L2(xb)
+    return xb
+
+
+def _factory_for(num_vectors: int) -> str:
+    if num_vectors < MIN_TRAIN_VECTORS:
+        return FLAT_FACTORY
+    factory = settings.RAG_CONFIG.get('faiss_index_factory', 'auto')
+    if factory != 'auto':
+        return factory
+    return IVF_PQ_FACTORY if num_vectors >= IVF_PQ_MIN_VECTORS else FLAT_FACTORY
+
+
+def build_index(embeddings, labels: Optional[np.ndarray] = None, factory: Optional[str] = None):
+    """
+    Build a FAISS inner-product index for the given embeddings.
+
+    With the default "auto" factory this is an exact flat index, switching
+    to IVF-PQ once the corpus is large; RAG_CONFIG['faiss_index_factory']
+    can name any FAISS factory string instead (e.g. "SQ8" for one byte per
+    dimension or "HNSW32" for a graph index). Quantizers are trained on
+    the vectors passed here, so only build them from the full corpus.
+    """
+    xb = _normalized(embeddings)
+    if labels is None:
+        labels = np.arange(len(xb), dtype=np.int64)
+    factory = factory or _factory_for(len(xb))
+    base = faiss.index_factory(EMBEDDING_DIM, factory, faiss.METRIC_INNER_PRODUCT)
+    if not base.is_trained:
+        base.train(xb)
+    index = faiss.IndexIDMap2(base)
+    index.add_with_ids(xb, labels)
+    return index
+
+
+def _set_index(
+    index,
+    chunk_ids: List[uuid.UUID],
+    document_ids: List[uuid.UUID],
+    labels: Iterable[int]
+) -> None:
+    global _index, _labels, _chunk_ids, _label_documents, _documents, _next_label, _loaded
+    labels = [int(label) for label in labels]
+    _index = index
+    _labels = dict(zip(chunk_ids, labels))
+    _chunk_ids = dict(zip(labels, chunk_ids))
+    _label_documents = dict(zip(labels, document_ids))
+    _documents = {}
+    for label, document_id in _label_documents.items():
+        _documents.setdefault(document_id, set()).add(label)
+    _next_label = max(labels) + 1 if labels else 0
+    _loaded = True
+
+
+def _embedded_chunks(document_ids: Optional[List[uuid.UUID]] = None):
+    """(chunk ids, document ids, embeddings) of the stored chunks, optionally of some documents."""
+    from chat.models import DocumentChunk
+
+    rows = DocumentChunk.objects.filter(embedding__isnull=False)
+    if document_ids is not None:
+        rows = rows.filter(document_id__in=document_ids)
+    chunk_ids, chunk_documents, embeddings = [], [], []
+    for chunk_id, document_id, embedding in rows.values_list(
+        'id', 'document_id', 'embedding'
+    ).iterator(chunk_size=2000):
+        chunk_ids.append(chunk_id)
+        chunk_documents.append(document_id)
+        embeddings.append(embedding)
+    return chunk_ids, chunk_documents, embeddings
+
+
+def _build_from_database() -> None:
+    """Build the in-memory index from every embedded chunk in the database."""
+    chunk_ids, document_ids, embeddings = _embedded_chunks()
+    try:
+        index = build_index(embeddings) if chunk_ids else None
+    except Exception as e:
+        logger.error(f"Failed to build FAISS index from the database: {e}")
+        chunk_ids, document_ids, index = [], [], None
+    _set_index(index, chunk_ids, document_ids, range(len(chunk_ids)))
+    if index is not None:
+        logger.info(f"Built FAISS index with {len(chunk_ids)} vectors from the database")
+
+
+def _load() -> None:
+    """
+    Load the index once per process: from disk if it was persisted,
+    otherwise by building it from the chunks in the database. Called with
+    the write lock held.
+    """
+    if _loaded:
+        return
+    if not _index_path().exists() or not _ids_path().exists():
+        _build_from_database()
+        return
+    try:
+        index = faiss.read_index(str(_index_path()))
+        with np.load(_ids_path()) as ids:
+            chunk_ids = [uuid.UUID(bytes=bytes(b)) for b in ids['chunk_ids']]
+            document_ids = [uuid.UUID(bytes=bytes(b)) for b in ids['document_ids']]
+            labels = ids['labels']
+        _set_index(index, chunk_ids, document_ids, labels)
+        logger.info(f"Loaded FAISS index with {index.ntotal} vectors")
+    except Exception as e:
+        logger.error(f"Failed to load FAISS index: {e}")
+        _build_from_database()
+
+
+def _ensure_loaded() -> None:
+    if not _loaded:
+        with _lock.write():
+            _load()
+
+
+def save() -> None:
+    """
+    Persist the in-memory index and its label maps to disk.
+
+    Only call this from a single writer (the ingest_docs command): every
+    worker holds its own copy of the index, so workers saving in turn
+    would overwrite each other's file.
+    """
+    with _lock.read():
+        if _index is None:
+            return
+        labels = list(_chunk_ids)
+        path = _index_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        faiss.write_index(_index, str(path))
+        np.savez(
+            _ids_path(),
+            labels=np.array(labels, dtype=np.int64),
+            chunk_ids=np.array([_chunk_ids[label].bytes for label in labels], dtype='S16'),
+            document_ids=np.array([_label_documents[label].bytes for label in labels], dtype='S16'),
+        )
+
+
+def _is_flat(index) -> bool:
+    return isinstance(faiss.downcast_index(index.index), faiss.IndexFlat)
+
+
+def _retrain() -> None:
+    """
+    Replace a flat index that has outgrown it with the configured trained
+    index. Training runs outside the lock on a snapshot; chunks added or
+    removed meanwhile are carried over when the new index is swapped in.
+    """
+    global _index, _retrain_pending
+    try:
+        with _lock.read():
+            index = _index
+            if index is None:
+                return
+            labels = faiss.vector_to_array(index.id_map).copy()
+            vectors = index.index.reconstruct_n(0, index.ntotal)
+        trained = build_index(vectors, labels)
+        with _lock.write():
+            if _index is not index:
+                return  # replaced by rebuild() while training
+            snapshot = set(labels.tolist())
+            added = [label for label in _chunk_ids if label not in snapshot]
+            removed = snapshot.difference(_chunk_ids)
+            if added:
+                xb = np.vstack([index.reconstruct(label) for label in added])
+                trained.add_with_ids(xb, np.array(added, dtype=np.int64))
+            if removed:
+                try:
+                    trained.remove_ids(faiss.IDSelectorBatch(np.array(list(removed), dtype=np.int64)))
+                except RuntimeError:
+                    pass  # see _remove_labels
+            _index = trained
+        logger.info(f"Retrained FAISS index on {trained.ntotal} vectors")
+    except Exception as e:
+        logger.error(f"Failed to retrain FAISS index: {e}")
+    finally:
+        _retrain_pending = False
+
+
+def _claim_retrain() -> bool:
+    """
+    Return True (once) when the flat index holds enough vectors to train
+    the configured index on. Called with the write lock held.
+    """
+    global _retrain_pending
+    if _retrain_pending or _index is None or not _is_flat(_index):
+        return False
+    if _factory_for(_index.ntotal) == FLAT_FACTORY:
+        return False
+    _retrain_pending = True
+    return True
+
+
+def _remove_labels(labels: List[int]) -> None:
+    for label in labels:
+        del _labels[_chunk_ids.pop(label)]
+        document_id = _label_documents.pop(label)
+        document_labels = _documents[document_id]
+        document_labels.discard(label)
+        if not document_labels:
+            del _documents[document_id]
+    try:
+        _index.remove_ids(faiss.IDSelectorBatch(np.array(labels, dtype=np.int64)))
+    except RuntimeError:
+        # Graph indexes (HNSW) cannot delete; unmapped labels are never
+        # selected by search(), so they only cost memory until a rebuild.
+        pass
+
+
+def add_chunks(
+    chunk_ids: Iterable[uuid.UUID],
+    embeddings,
+    document_ids: Iterable[uuid.UUID]
+) -> None:
+    """
+    Add (or replace) chunk embeddings, starting a flat index on first use.
+
+    `document_ids` gives each chunk's document. A flat index that grows
+    past the training threshold is retrained in the background (see
+    _retrain).
+    """
+    global _next_label
+    if not is_available():
+        return
+    chunk_ids = list(chunk_ids)
+    document_ids = list(document_ids)
+    if not chunk_ids:
+        return
+    with _lock.write():
+        _load()
+        if _index is None:
+            # Never train a quantizer on a single upload batch
+            index = build_index(embeddings, factory=FLAT_FACTORY)
+            _set_index(index, chunk_ids, document_ids, range(len(chunk_ids)))
+            return
+        stale = [_labels[cid] for cid in chunk_ids if cid in _labels]
+        if stale:
+            _remove_labels(stale)
+        labels = np.arange(_next_label, _next_label + len(chunk_ids), dtype=np.int64)
+        _index.add_with_ids(_normalized(embeddings), labels)
+        _next_label += len(chunk_ids)
+        labels = labels.tolist()
+        _labels.update(zip(chunk_ids, labels))
+        _chunk_ids.update(zip(labels, chunk_ids))
+        _label_documents.update(zip(labels, document_ids))
+        for label, document_id in zip(labels, document_ids):
+            _documents.setdefault(document_id, set()).add(label)
+        retrain = _claim_retrain()
+    if retrain:
+        from chat.tasks import run_in_background
+
+        run_in_background(_retrain)
+
+
+def remove_chunks(chunk_ids: Iterable[uuid.UUID]) -> None:
+    """Drop chunks from the index; unknown ids are ignored."""
+    if not is_available():
+        return
+    with _lock.write():
+        _load()
+        if _index is None:
+            return
+        labels = [_labels[cid] for cid in chunk_ids if cid in _labels]
+        if labels:
+            _remove_labels(labels)
+
+
+def rebuild(
+    chunk_ids: Iterable[uuid.UUID],
+    embeddings,
+    document_ids: Iterable[uuid.UUID]
+) -> None:
+    """Replace the index with one built from scratch."""
+    if not is_available():
+        return
+    chunk_ids = list(chunk_ids)
+    with _lock.write():
+        index = build_index(embeddings) if chunk_ids else None
+        _set_index(index, chunk_ids, list(document_ids), range(len(chunk_ids)))
+
+
+def _index_documents(document_ids: List[uuid.UUID]) -> None:
+    """Add the chunks of documents this process has not indexed yet."""
+    chunk_ids, chunk_documents, embeddings = _embedded_chunks(document_ids)
+    if chunk_ids:
+        add_chunks(chunk_ids, embeddings, chunk_documents)
+
+
+def _search_params(selector):
+    if faiss.try_extract_index_ivf(_index) is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=IVF_NPROBE)
+    if isinstance(faiss.downcast_index(_index.index), faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=HNSW_EF_SEARCH)
+    if selector is not None:
+        return faiss.SearchParameters(sel=selector)
+    return None
+
+
+def search(
+    query_embedding,
+    k: int,
+    document_ids: Optional[Iterable[uuid.UUID]] = None
+) -> Optional[List[Tuple[float, uuid.UUID]]]:
+    """
+    Return the top-k (score, chunk_id) pairs, best first.
+
+    With `document_ids` only chunks of those documents are searched (via
+    a label selector); documents this process has not indexed yet are
+    loaded from the database first. Returns None when FAISS is
+    unavailable or the index cannot be used, so the caller can fall back
+    to an exact scan.
+    """
+    if not is_available():
+        return None
+    _ensure_loaded()
+    if document_ids is not None:
+        document_ids = list(document_ids)
+        with _lock.read():
+            missing = [doc_id for doc_id in document_ids if doc_id not in _documents]
+        if missing:
+            try:
+                _index_documents(missing)
+            except Exception as e:
+                logger.error(f"Failed to index documents for search: {e}")
+                return None
+
+    with _lock.read():
+        if _index is None:
+            return None
+        if document_ids is None:
+            num_candidates = len(_chunk_ids)
+            selector = None
+        else:
+            labels = [label for doc_id in document_ids for label in _documents.get(doc_id, ())]
+            num_candidates = len(labels)
+            selector = None
+            if num_candidates < len(_chunk_ids):
+                selector = faiss.IDSelectorBatch(np.array(labels, dtype=np.int64))
+        k = min(k, num_candidates)
+        if k <= 0:
+            return []
+
+        D, I = _index.search(_normalized(query_embedding), k, params=_search_params(selector))
+        return [
+            (float(score), _chunk_ids[label])
+            for score, label in zip(D[0], I[0])
+            if label in _chunk_ids
+        ]
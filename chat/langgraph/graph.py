@@ -3,7 +3,8 @@ LangGraph orchestration for chat flow.
 
 This module defines the chat orchestration graph using LangGraph.
 The graph coordinates: history loading, retrieval decision, RAG search,
-LLM synthesis, and session summarization.
+and LLM synthesis. Session summarization runs afterwards as a background
+task (see chat.tasks.schedule_summary) so it never delays a response.
 """
 import logging
 from typing import Dict, Any
@@ -12,65 +13,53 @@ from langgraph.graph import StateGraph, END
 from .state import GraphState
 from .nodes import (
     load_history,
-    decide_retrieve,
+    load_context,
     retrieve,
-    synthesize,
-    summarize
+    synthesize
 )
+from .nodes.decide_retrieve import needs_retrieval
 
 logger = logging.getLogger(__name__)
 
 
-def create_chat_graph() -> StateGraph:
+def create_chat_graph(with_retrieval: bool = True) -> StateGraph:
     """
     Create and compile the chat orchestration graph.
     
-    Flow:
-        START → LoadHistory → DecideRetrieve → [Retrieve?] → Synthesize → Summarize → END
+    The retrieval decision is made in Python before the graph runs (see
+    `needs_retrieval`), so each variant is a straight line with no router:
     
+        with_retrieval:    START → LoadContext → Retrieve → Synthesize → END
+        without retrieval: START → LoadHistory → Synthesize → END
+    
+    Args:
+        with_retrieval: Include query embedding and the retrieve node
+        
     Returns:
         Compiled LangGraph application
     """
-    # Create graph
     graph = StateGraph(GraphState)
     
-    # Add nodes
-    graph.add_node("load_history", load_history)
-    graph.add_node("decide_retrieve", decide_retrieve)
-    graph.add_node("retrieve", retrieve)
-    graph.add_node("synthesize", synthesize)
-    graph.add_node("summarize", summarize)
-    
-    # Define edges
-    graph.set_entry_point("load_history")
-    graph.add_edge("load_history", "decide_retrieve")
+    if with_retrieval:
+        graph.add_node("load_context", load_context)
+        graph.add_node("retrieve", retrieve)
+        graph.set_entry_point("load_context")
+        graph.add_edge("load_context", "retrieve")
+        graph.add_edge("retrieve", "synthesize")
+    else:
+        graph.add_node("load_history", load_history)
+        graph.set_entry_point("load_history")
+        graph.add_edge("load_history", "synthesize")
     
-    # Conditional edge: retrieve only if needed
-    def should_retrieve(state: Dict[str, Any]) -> str:
-        """Route to retrieve node or skip to synthesize."""
-        if state.get('need_retrieval', False):
-            return "retrieve"
-        return "synthesize"
-    
-    graph.add_conditional_edges(
-        "decide_retrieve",
-        should_retrieve,
-        {
-            "retrieve": "retrieve",
-            "synthesize": "synthesize"
-        }
-    )
-    
-    graph.add_edge("retrieve", "synthesize")
-    graph.add_edge("synthesize", "summarize")
-    graph.add_edge("summarize", END)
+    graph.add_node("synthesize", synthesize)
+    graph.add_edge("synthesize", END)
     
-    # Compile
     return graph.compile()
 
 
-# Create singleton graph instance
-chat_graph = create_chat_graph()
+# Compiled once at import; run_graph picks one per request
+chat_graph = create_chat_graph(with_retrieval=True)
+chat_graph_without_retrieval = create_chat_graph(with_retrieval=False)
 
 
 def run_graph(
@@ -95,6 +84,8 @@ def run_graph(
     Returns:
         Dict with response content, chunks, and metadata
     """
+    need_retrieval = needs_retrieval(user_message)
+    
     # Initialize state
     initial_state = {
         'session_id': session_id,
@@ -102,7 +93,8 @@ def run_graph(
         'model': model,
         'history': [],
         'summary': None,
-        'need_retrieval': True,  # Will be decided by node
+        'query_embedding': None,
+        'need_retrieval': need_retrieval,
         'retrieved_chunks': [],
         'draft': '',
         'metadata': {},
@@ -114,7 +106,8 @@ def run_graph(
     
     try:
         # Execute graph
-        final_state = chat_graph.invoke(initial_state)
+        graph = chat_graph if need_retrieval else chat_graph_without_retrieval
+        final_state = graph.invoke(initial_state)
         
         # Check for errors
         if final_state.get('error'):
@@ -132,12 +125,14 @@ def run_graph(
 
 
 def run_graph_stream(session_id: str, user_message: str, model: str = "gpt-4o-mini", 
-                     top_k: int = 3, use_mmr: bool = True, lambda_param: float = 0.5):
+                     top_k: int = 3, use_mmr: bool = True, lambda_param: float = 0.5,
+                     user_message_saved: bool = False):
     """
     Run chat graph with streaming response (manual orchestration).
     
     This manually orchestrates the graph nodes to support streaming,
-    since LangGraph's compiled graph doesn't stream well.
+    since LangGraph's compiled graph doesn't stream well. Nodes return
+    only the keys they change, which are merged into `state` in place.
     
     Args:
         session_id: UUID of the chat session
@@ -146,6 +141,8 @@ def run_graph_stream(session_id: str, user_message: str, model: str = "gpt-4o-mi
         top_k: Number of chunks to retrieve
         use_mmr: Whether to use MMR for retrieval
         lambda_param: MMR lambda parameter
+        user_message_saved: The message is already stored as the session's
+            newest message, so history loading leaves it out
         
     Yields:
         Text deltas from LLM
@@ -153,20 +150,18 @@ def run_graph_stream(session_id: str, user_message: str, model: str = "gpt-4o-mi
     Returns:
         Final dict with content, retrieved_chunks, metadata
     """
-    from .nodes.load_history import load_history
-    from .nodes.decide_retrieve import decide_retrieve
-    from .nodes.retrieve import retrieve
     from .nodes.synthesize_stream import synthesize_stream
-    from .nodes.summarize import summarize
     
     # Initial state
     state = {
         'session_id': session_id,
         'last_user_msg': user_message,
+        'user_message_saved': user_message_saved,
         'model': model,
         'history': [],
         'summary': None,
-        'need_retrieval': True,
+        'query_embedding': None,
+        'need_retrieval': needs_retrieval(user_message),
         'retrieved_chunks': [],
         'draft': '',
         'metadata': {},
@@ -179,20 +174,23 @@ def run_graph_stream(session_id: str, user_message: str, model: str = "gpt-4o-mi
     }
     
     try:
-        # Step 1: Load history
-        state = load_history(state)
-        if state.get('error'):
-            raise Exception(state['error'])
-        
-        # Step 2: Decide if retrieval is needed
-        state = decide_retrieve(state)
+        if state['need_retrieval']:
+            # Step 1: Load history (query is embedded concurrently)
+            state.update(load_context(state))
+            if state.get('error'):
+                raise Exception(state['error'])
+            
+            # Step 2: Retrieve
+            state.update(retrieve(state))
+            if state.get('error'):
+                raise Exception(state['error'])
+        else:
+            # Step 1: Load history only
+            state.update(load_history(state))
+            if state.get('error'):
+                raise Exception(state['error'])
         
-        # Step 3: Retrieve if needed
-        state = retrieve(state)
-        if state.get('error'):
-            raise Exception(state['error'])
-        
-        # Step 4: Synthesize with streaming
+        # Step 3: Synthesize with streaming
         generator = synthesize_stream(state)
         
         # Yield deltas
@@ -200,16 +198,13 @@ def run_graph_stream(session_id: str, user_message: str, model: str = "gpt-4o-mi
             if isinstance(delta, str):
                 yield delta
             else:
-                # Last item is the final state
-                state = delta
+                # Last item is the final state update
+                state.update(delta)
         
         # Check for synthesis errors
         if state.get('error'):
             raise Exception(state['error'])
         
-        # Step 5: Update summary (non-blocking, doesn't affect stream)
-        state = summarize(state)
-        
         # Yield final result as dict
         yield {
             'content': state.get('draft', ''),
@@ -2,6 +2,7 @@
 LangGraph nodes for chat orchestration.
 """
 from .load_history import load_history
+from .load_context import load_context
 from .decide_retrieve import decide_retrieve
 from .retrieve import retrieve
 from .synthesize import synthesize
@@ -9,6 +10,7 @@ from .summarize import summarize
 
 __all__ = [
     'load_history',
+    'load_context',
     'decide_retrieve',
     'retrieve',
     'synthesize',
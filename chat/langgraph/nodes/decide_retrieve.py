@@ -2,50 +2,68 @@
 DecideRetrieve Node - Decides whether retrieval is needed for the query.
 """
 import logging
+import re
 from typing import Dict, Any
 
 logger = logging.getLogger(__name__)
 
+QUESTION_WORDS = ('what', 'how', 'why', 'when', 'where', 'who', 'explain', 'tell', 'describe', 'give', 'show', 'list', 'provide', '?')
+REFERENCE_WORDS = ('document', 'file', 'source', 'according to', 'based on')
+SIMPLE_RESPONSES = frozenset({'hi', 'hello', 'thanks', 'thank you', 'ok', 'okay', 'yes', 'no'})
 
-def decide_retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
+# One alternation over every keyword, so a single pass over the message finds
+# either kind (named groups tell them apart). The lookahead keeps matches
+# overlapping, i.e. the same substring semantics as `word in message`.
+_KEYWORD_RE = re.compile(
+    '(?=(?P<question>' + '|'.join(map(re.escape, QUESTION_WORDS)) + ')'
+    '|(?P<reference>' + '|'.join(map(re.escape, REFERENCE_WORDS)) + '))'
+)
+
+
+def needs_retrieval(message: str) -> bool:
     """
-    Decide if retrieval is needed based on user message.
+    Decide if retrieval is needed for a user message.
     
     Uses simple heuristics:
     - Message contains question words
     - Message is long enough to need context
     - Message references factual information
     
+    Pure Python with no state access, so callers can pick a graph
+    variant before invoking it.
+    
     Args:
-        state: Current graph state
+        message: Raw user message
         
     Returns:
-        Updated state with need_retrieval flag
+        True if document retrieval should run
     """
-    message = state['last_user_msg'].lower()
-    
-    # Heuristic 1: Contains question indicators
-    question_words = ['what', 'how', 'why', 'when', 'where', 'who', 'explain', 'tell', 'describe', 'give', 'show', 'list', 'provide']
-    has_question = any(word in message for word in question_words) or '?' in message
-    
-    # Heuristic 2: References documents or sources
-    reference_words = ['document', 'file', 'source', 'according to', 'based on']
-    references_docs = any(word in message for word in reference_words)
+    message = message.lower()
     
-    # Heuristic 3: Long message (likely needs detailed answer)
-    is_long = len(message.split()) > 10
+    # Not a simple greeting or acknowledgment
+    if message.strip() in SIMPLE_RESPONSES:
+        return False
     
-    # Heuristic 4: Not a simple greeting or acknowledgment
-    simple_responses = ['hi', 'hello', 'thanks', 'thank you', 'ok', 'okay', 'yes', 'no']
-    is_simple = message.strip() in simple_responses
+    # Retrieve if question indicators or document references appear
+    # anywhere in the message, or if it is long (likely needs detail)
+    return _KEYWORD_RE.search(message) is not None or len(message.split()) > 10
+
+
+def decide_retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Decide if retrieval is needed based on user message.
     
-    # Decision: retrieve if question, references, or long (but not if simple)
-    need_retrieval = (has_question or references_docs or is_long) and not is_simple
+    Args:
+        state: Current graph state
+        
+    Returns:
+        State update with need_retrieval flag
+    """
+    message = state['last_user_msg']
+    need_retrieval = needs_retrieval(message)
     
-    logger.info(f"DecideRetrieve: need_retrieval={need_retrieval} for message: {message[:50]}...")
+    logger.info(f"DecideRetrieve: need_retrieval={need_retrieval} for message: {message[:50].lower()}...")
     
     return {
-        **state,
         'need_retrieval': need_retrieval
     }
-
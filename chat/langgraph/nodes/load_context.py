@@ -0,0 +1,42 @@
+"""
+LoadContext Node - Loads history while the query embedding is computed.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+
+from chat.embedding_utils import embed_query
+from .load_history import load_history
+
+logger = logging.getLogger(__name__)
+
+# Embedding is CPU/GPU bound and touches no database state, so it can run
+# off-thread while the request thread does the history queries.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='embed-query')
+
+
+def load_context(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Load conversation history and embed the user message concurrently.
+
+    The two steps have no data dependency, so the request pays roughly
+    max(db_latency, embed_latency) instead of their sum. Database access
+    stays on the calling thread (and therefore in its transaction).
+
+    Args:
+        state: Current graph state with session_id and last_user_msg
+
+    Returns:
+        State update from load_history plus query_embedding
+    """
+    future = _executor.submit(embed_query, state['last_user_msg'])
+    update = load_history(state)
+
+    try:
+        update['query_embedding'] = future.result()
+    except Exception as e:
+        # Retrieval will embed the query itself if it needs to
+        logger.error(f"Query embedding prefetch failed: {e}")
+        update['query_embedding'] = None
+
+    return update
@@ -3,9 +3,11 @@ LoadHistory Node - Loads conversation context from database with token budget.
 """
 import logging
 from typing import Dict, Any
+import numpy as np
 from django.conf import settings
-from chat.models import ChatSession, ChatMessage
-from chat.llm import count_tokens
+from chat.context_cache import get_recent_messages
+from chat.models import ChatSession
+from chat.llm import count_tokens_batch
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +21,7 @@ def load_history(state: Dict[str, Any]) -> Dict[str, Any]:
         state: Current graph state with session_id
         
     Returns:
-        Updated state with history and summary (token-bounded)
+        State update with history and summary (token-bounded)
     """
     session_id = state['session_id']
     
@@ -30,32 +32,39 @@ def load_history(state: Dict[str, Any]) -> Dict[str, Any]:
     
     try:
         # Get session
-        session = ChatSession.objects.get(id=session_id)
+        session = ChatSession.objects.only('long_term_summary', 'updated_at').get(id=session_id)
         
-        # Load more messages than we need (for trimming)
-        messages = list(ChatMessage.objects.filter(
-            session=session
-        ).order_by('-created_at')[:20])
+        # Load more messages than we need (for trimming); cached until the
+        # session's next write
+        messages = get_recent_messages(session)
+        if (state.get('user_message_saved') and messages
+                and messages[0][:2] == ('user', state['last_user_msg'])):
+            # The current question was stored before the graph ran; it is
+            # sent as the final user message, not as history
+            messages = messages[1:]
         
-        # Token-bounded trimming (newest first, then reverse)
-        history = []
-        token_count = 0
+        # Token counts are stored on save; batch-encode only legacy rows without one
+        message_tokens = [tokens for _, _, tokens in messages]
+        missing = [i for i, (_, content, tokens) in enumerate(messages) if not tokens and content]
+        if missing:
+            counts = count_tokens_batch(
+                [messages[i][1] for i in missing],
+                state.get('model', 'gpt-4o-mini')
+            )
+            for i, count in zip(missing, counts):
+                message_tokens[i] = count
         
-        for msg in messages:
-            msg_tokens = count_tokens(msg.content, state.get('model', 'gpt-4o-mini'))
-            
-            # Keep message if:
-            # 1. Still under budget, OR
-            # 2. Haven't reached minimum turns yet
-            if token_count + msg_tokens <= max_tokens or len(history) < min_turns:
-                history.append({
-                    'role': msg.role,
-                    'content': msg.content
-                })
-                token_count += msg_tokens
-            else:
-                # Budget exceeded and have minimum turns
-                break
+        # Token-bounded trimming (newest first): keep the longest prefix that
+        # fits the budget, but never fewer than min_turns messages
+        cumulative = np.cumsum(message_tokens, dtype=np.int64)
+        cutoff = max(min_turns, int(np.searchsorted(cumulative, max_tokens, side='right')))
+        cutoff = min(cutoff, len(messages))
+        token_count = int(cumulative[cutoff - 1]) if cutoff else 0
+        
+        history = [
+            {'role': role, 'content': content}
+            for role, content, _ in messages[:cutoff]
+        ]
         
         # Reverse to chronological order (oldest first)
         history.reverse()
@@ -64,7 +73,6 @@ def load_history(state: Dict[str, Any]) -> Dict[str, Any]:
         
         # Update state
         return {
-            **state,
             'history': history,
             'summary': session.long_term_summary,
             'error': None
@@ -73,7 +81,6 @@ def load_history(state: Dict[str, Any]) -> Dict[str, Any]:
     except ChatSession.DoesNotExist:
         logger.error(f"Session {session_id} not found")
         return {
-            **state,
             'history': [],
             'summary': None,
             'error': 'Session not found'
@@ -81,7 +88,6 @@ def load_history(state: Dict[str, Any]) -> Dict[str, Any]:
     except Exception as e:
         logger.error(f"Error loading history: {e}")
         return {
-            **state,
             'history': [],
             'summary': None,
             'error': str(e)
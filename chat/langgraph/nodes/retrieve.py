@@ -17,13 +17,12 @@ def retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
         state: Current graph state
         
     Returns:
-        Updated state with retrieved_chunks
+        State update with retrieved_chunks
     """
     # Skip if retrieval not needed
     if not state.get('need_retrieval', False):
         logger.info("Skipping retrieval (not needed)")
         return {
-            **state,
             'retrieved_chunks': []
         }
     
@@ -34,7 +33,8 @@ def retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
             top_k=state.get('top_k', 3),
             use_mmr=state.get('use_mmr', True),
             lambda_param=state.get('lambda_param', 0.5),
-            session_id=state.get('session_id')
+            session_id=state.get('session_id'),
+            query_embedding=state.get('query_embedding')
         )
         
         # Format results
@@ -43,7 +43,7 @@ def retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
                 'text': chunk.text,
                 'score': float(score),
                 'chunk_id': str(chunk.id),
-                'document': chunk.document.filename
+                'document': chunk.document_filename
             }
             for score, chunk in results
         ]
@@ -51,7 +51,6 @@ def retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
         logger.info(f"Retrieved {len(retrieved_chunks)} chunks")
         
         return {
-            **state,
             'retrieved_chunks': retrieved_chunks
         }
         
@@ -59,7 +58,6 @@ def retrieve(state: Dict[str, Any]) -> Dict[str, Any]:
         logger.error(f"Retrieval error: {e}")
         # Continue without retrieval on error
         return {
-            **state,
             'retrieved_chunks': [],
             'error': f"Retrieval error: {str(e)}"
         }
@@ -3,11 +3,52 @@ Summarize Node - Updates session summary every 5 assistant turns.
 """
 import logging
 from typing import Dict, Any
+from django.db import connection
+from django.db.models import TextField, Value
+from django.db.models.functions import Concat, Left, Substr, Upper
 from chat.models import ChatSession, ChatMessage
 from chat.llm import call_llm
 
 logger = logging.getLogger(__name__)
 
+SUMMARY_WINDOW = 20
+
+
+def _conversation_text(session: ChatSession) -> str:
+    """
+    Render the last SUMMARY_WINDOW messages as "Role: content" lines, oldest first.
+    
+    On PostgreSQL the lines are concatenated by STRING_AGG in one query, so
+    message bodies are never materialized as model instances in Python.
+    
+    Args:
+        session: ChatSession to render
+        
+    Returns:
+        Newline-joined conversation transcript
+    """
+    recent = ChatMessage.objects.filter(session=session).order_by('-created_at')
+    
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.aggregates import StringAgg
+        
+        line = Concat(
+            Upper(Left('role', 1)), Substr('role', 2), Value(': '), 'content',
+            output_field=TextField()
+        )
+        result = ChatMessage.objects.filter(
+            pk__in=recent.values('pk')[:SUMMARY_WINDOW]
+        ).aggregate(
+            text=StringAgg(line, delimiter='\n', order_by='created_at')
+        )
+        return result['text'] or ''
+    
+    recent_messages = list(recent.only('role', 'content', 'created_at')[:SUMMARY_WINDOW])
+    return "\n".join(
+        f"{msg.role.capitalize()}: {msg.content}"
+        for msg in reversed(recent_messages)
+    )
+
 
 def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -17,33 +58,22 @@ def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
         state: Current graph state
         
     Returns:
-        Updated state (summary updated in database if needed)
+        State update with the new summary, if one was generated
     """
     session_id = state['session_id']
     
     try:
-        session = ChatSession.objects.get(id=session_id)
+        session = ChatSession.objects.only('id', 'assistant_message_count').get(id=session_id)
         
-        # Count assistant messages
-        assistant_count = ChatMessage.objects.filter(
-            session=session,
-            role='assistant'
-        ).count()
+        # Assistant turns are counted by a post_save signal, no COUNT(*) needed
+        assistant_count = session.assistant_message_count
         
         # Update summary every 5 turns
         if assistant_count > 0 and assistant_count % 5 == 0:
             logger.info(f"Generating summary for session {session_id} (turn {assistant_count})")
             
-            # Get recent messages for summary
-            recent_messages = ChatMessage.objects.filter(
-                session=session
-            ).order_by('-created_at')[:20]
-            
-            # Build conversation text
-            conversation_text = "\n".join([
-                f"{msg.role.capitalize()}: {msg.content}"
-                for msg in reversed(recent_messages)
-            ])
+            # Build conversation text from recent messages
+            conversation_text = _conversation_text(session)
             
             # Generate summary using LLM
             summary_prompt = [
@@ -69,27 +99,26 @@ def summarize(state: Dict[str, Any]) -> Dict[str, Any]:
                 
                 # Save to database
                 session.long_term_summary = summary
-                session.save()
+                session.save(update_fields=['long_term_summary', 'updated_at'])
                 
                 logger.info(f"Summary updated: {summary[:100]}...")
                 
                 return {
-                    **state,
                     'summary': summary
                 }
                 
             except Exception as e:
                 logger.error(f"Error generating summary: {e}")
                 # Don't fail the whole request if summary fails
-                return state
+                return {}
         
         # No summary needed this turn
-        return state
+        return {}
         
     except ChatSession.DoesNotExist:
         logger.error(f"Session {session_id} not found for summarization")
-        return state
+        return {}
     except Exception as e:
         logger.error(f"Summarization error: {e}")
-        return state
+        return {}
 
@@ -6,11 +6,12 @@ from typing import Dict, Any
 from openai import OpenAIError, RateLimitError, AuthenticationError
 
 from chat import llm as llm_module
-from chat.prompts import build_chat_prompt
-from chat.models import ChatMessage
+from chat.prompts import assemble_messages, format_retrieved_chunks
 
 logger = logging.getLogger(__name__)
 
+SYNTHESIZE_SYSTEM_PROMPT = "You are a helpful AI assistant with access to a knowledge base. Answer questions accurately based on the provided context. If the context doesn't contain relevant information, say so clearly. Be concise but comprehensive."
+
 
 def synthesize(state: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -20,49 +21,32 @@ def synthesize(state: Dict[str, Any]) -> Dict[str, Any]:
         state: Current graph state with history and retrieved chunks
         
     Returns:
-        Updated state with draft (LLM response) and metadata
+        State update with draft (LLM response) and metadata
     """
     try:
-        # Convert history to ChatMessage-like objects for build_chat_prompt
-        # build_chat_prompt expects ChatMessage objects, but we have dicts
-        # So we'll build the messages array directly here
-        
-        messages = [
-            {"role": "system", "content": "You are a helpful AI assistant with access to a knowledge base. Answer questions accurately based on the provided context. If the context doesn't contain relevant information, say so clearly. Be concise but comprehensive."}
-        ]
+        # History is already a list of {role, content} dicts, so the messages
+        # array is assembled directly rather than via build_chat_prompt
+        system_contents = [SYNTHESIZE_SYSTEM_PROMPT]
         
         # Add summary if exists
         if state.get('summary'):
-            messages.append({
-                "role": "system",
-                "content": f"Previous conversation summary: {state['summary']}"
-            })
+            system_contents.append(f"Previous conversation summary: {state['summary']}")
         
-        # Add retrieved context
+        # Retrieved context changes with every query, so it follows the
+        # (cacheable) history instead of preceding it
+        context_contents = []
         if state.get('retrieved_chunks'):
-            chunks_text = "\n\n".join([
-                f"[Source {i+1}: {chunk.get('document', 'Unknown')} (relevance: {chunk.get('score', 0):.2f})]\n{chunk['text']}"
-                for i, chunk in enumerate(state['retrieved_chunks'])
-            ])
-            messages.append({
-                "role": "system",
-                "content": f"Relevant information from knowledge base:\n\n{chunks_text}"
-            })
+            chunks_text = format_retrieved_chunks(state['retrieved_chunks'])
+            context_contents.append(f"Relevant information from knowledge base:\n\n{chunks_text}")
         
-        # Add conversation history (exclude last user message if it's already there)
-        for msg in state.get('history', []):
-            # Skip if this is the current user message
-            if msg.get('content') != state['last_user_msg']:
-                messages.append({
-                    "role": msg['role'],
-                    "content": msg['content']
-                })
-        
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": state['last_user_msg']
-        })
+        # Add conversation history (the current user message is stored after
+        # the graph runs), the retrieved context, then the current user message
+        messages = assemble_messages(
+            system_contents,
+            state.get('history', []),
+            user_content=state['last_user_msg'],
+            context_contents=context_contents
+        )
         
         # Call LLM
         llm_response = llm_module.call_llm(
@@ -74,11 +58,11 @@ def synthesize(state: Dict[str, Any]) -> Dict[str, Any]:
         
         # Update state
         return {
-            **state,
             'draft': llm_response['content'],
             'metadata': {
                 **state.get('metadata', {}),
                 'tokens_used': llm_response['tokens_used'],
+                'completion_tokens': llm_response.get('completion_tokens'),
                 'model': llm_response['model'],
                 'finish_reason': llm_response.get('finish_reason', 'stop'),
                 'retrieval_count': len(state.get('retrieved_chunks', [])),
@@ -87,17 +71,18 @@ def synthesize(state: Dict[str, Any]) -> Dict[str, Any]:
             'error': None
         }
         
+    except llm_module.LLMBusyError:
+        # Surfaces as a 503 rather than a failed turn
+        raise
     except (AuthenticationError, RateLimitError, OpenAIError) as e:
         logger.error(f"LLM error: {e}")
         return {
-            **state,
             'draft': '',
             'error': f"LLM error: {str(e)}"
         }
     except Exception as e:
         logger.error(f"Synthesis error: {e}")
         return {
-            **state,
             'draft': '',
             'error': f"Synthesis error: {str(e)}"
         }
@@ -3,8 +3,8 @@ SynthesizeStream Node - Builds prompt and streams LLM response.
 """
 import logging
 from typing import Dict, Any, Generator
-from chat.llm import stream_llm
-from chat.prompts import SYSTEM_PROMPT, format_retrieved_chunks, sanitize_user_input
+from chat.llm import LLMBusyError, stream_llm
+from chat.prompts import SYSTEM_PROMPT, assemble_messages, format_retrieved_chunks, sanitize_user_input
 
 logger = logging.getLogger(__name__)
 
@@ -20,64 +20,61 @@ def synthesize_stream(state: Dict[str, Any]) -> Generator[str, None, Dict[str, A
         Text deltas from LLM
         
     Returns:
-        Final state with accumulated draft response
+        Final state update with accumulated draft response
     """
     try:
         # Build messages manually (same logic as build_simple_prompt but with history)
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        system_contents = [SYSTEM_PROMPT]
         
         # Add summary if exists
         if state.get('summary'):
-            messages.append({
-                "role": "system",
-                "content": f"Previous conversation summary: {state['summary']}"
-            })
+            system_contents.append(f"Previous conversation summary: {state['summary']}")
         
-        # Add retrieved chunks if any
+        # Retrieved chunks change with every query, so they follow the
+        # (cacheable) history instead of preceding it
+        context_contents = []
         retrieved_chunks = state.get('retrieved_chunks', [])
         if retrieved_chunks:
             context = format_retrieved_chunks(retrieved_chunks)
-            messages.append({
-                "role": "system",
-                "content": f"Relevant information:\n{context}"
-            })
+            context_contents.append(f"Relevant information:\n{context}")
         
-        # Add history
-        for msg in state.get('history', []):
-            messages.append({
-                "role": msg['role'],
-                "content": msg['content']
-            })
-        
-        # Add current user message
-        messages.append({
-            "role": "user",
-            "content": sanitize_user_input(state['last_user_msg'])
-        })
+        # Add history (the current user message is stored after the graph
+        # runs), the retrieved chunks and the current user message
+        messages = assemble_messages(
+            system_contents,
+            state.get('history', []),
+            user_content=sanitize_user_input(state['last_user_msg']),
+            context_contents=context_contents
+        )
         
         # Stream LLM response
         accumulated = ""
+        usage = {}
         for delta in stream_llm(
             messages=messages,
             model=state.get('model', 'gpt-4o-mini'),
             temperature=state.get('temperature', 0.7),
-            max_tokens=state.get('max_tokens', 2000)
+            max_tokens=state.get('max_tokens', 2000),
+            usage=usage
         ):
             accumulated += delta
             yield delta
         
-        # Yield final state with accumulated response
+        # Yield final state with accumulated response and the provider's
+        # token usage (empty if it was not reported)
         yield {
-            **state,
             'draft': accumulated,
+            'metadata': {**state.get('metadata', {}), **usage},
             'error': None
         }
         
+    except LLMBusyError:
+        # Reported to the client as busy rather than a failed turn
+        raise
     except Exception as e:
         logger.error(f"Synthesis streaming error: {e}")
         # On error, yield state with error
         yield {
-            **state,
             'draft': '',
             'error': f"Synthesis error: {e}"
         }
@@ -11,6 +11,7 @@ class GraphState(TypedDict):
     # Session & input
     session_id: str
     last_user_msg: str
+    user_message_saved: bool  # last_user_msg is already the newest stored message
     model: str
     
     # Context loading
@@ -18,6 +19,7 @@ class GraphState(TypedDict):
     summary: Optional[str]
     
     # Retrieval decision & results
+    query_embedding: Optional[Any]  # Prefetched by load_context
     need_retrieval: bool
     retrieved_chunks: List[Dict[str, Any]]  # [{text, score, chunk_id, document}, ...]
     
@@ -4,16 +4,43 @@ API key is loaded from environment variables, never hardcoded.
 """
 import os
 import logging
+import threading
+from functools import lru_cache
 from typing import List, Dict, Optional
 from openai import OpenAI, OpenAIError, RateLimitError, AuthenticationError
 import tiktoken
 
 logger = logging.getLogger(__name__)
 
+# Process-wide cap on in-flight OpenAI requests: bursts wait here for a slot
+# instead of fanning out into provider 429s. A stream holds its slot until
+# the last delta (or until the client disconnects). A request that waits
+# longer than LLM_SLOT_TIMEOUT seconds gives up with LLMBusyError.
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+LLM_SLOT_TIMEOUT = float(os.environ.get('LLM_SLOT_TIMEOUT', '30'))
+_llm_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
 
-def get_openai_client() -> OpenAI:
+
+class LLMBusyError(Exception):
+    """No LLM slot freed up within LLM_SLOT_TIMEOUT seconds."""
+
+
+def _acquire_llm_slot() -> None:
+    """
+    Take one of the process-wide LLM slots; the caller must release it.
+    
+    Raises:
+        LLMBusyError: If every slot stays taken for LLM_SLOT_TIMEOUT seconds
+    """
+    if not _llm_slots.acquire(timeout=LLM_SLOT_TIMEOUT):
+        raise LLMBusyError(
+            f"All {LLM_MAX_CONCURRENCY} LLM slots stayed busy for {LLM_SLOT_TIMEOUT:g}s"
+        )
+
+
+def _get_api_key() -> str:
     """
-    Get OpenAI client with API key from environment.
+    Read the OpenAI API key from the environment.
     Raises ValueError if API key not found.
     """
     api_key = os.environ.get('OPENAI_API_KEY')
@@ -24,9 +51,35 @@ def get_openai_client() -> OpenAI:
             "Please set it in your .env file or environment."
         )
     
+    return api_key
+
+
+@lru_cache(maxsize=4)
+def _openai_client(api_key: str) -> OpenAI:
     return OpenAI(api_key=api_key)
 
 
+def get_openai_client() -> OpenAI:
+    """
+    Get the shared OpenAI client for the API key in the environment.
+    
+    Clients are cached per key (they are thread-safe), so every LLM call
+    reuses one HTTP connection pool and its keep-alive TLS connections.
+    Raises ValueError if API key not found.
+    """
+    return _openai_client(_get_api_key())
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model: str) -> tiktoken.Encoding:
+    """Return the (cached) tiktoken encoding for a model."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Fallback to cl100k_base encoding for unknown models
+        return tiktoken.get_encoding("cl100k_base")
+
+
 def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
     """
     Count tokens in text for a given model.
@@ -38,13 +91,23 @@ def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
     Returns:
         Number of tokens
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        # Fallback to cl100k_base encoding for unknown models
-        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_get_encoding(model).encode(text))
+
+
+def count_tokens_batch(texts: List[str], model: str = "gpt-4o-mini") -> List[int]:
+    """
+    Count tokens for many texts with one batched (multi-threaded) encode.
     
-    return len(encoding.encode(text))
+    Args:
+        texts: The texts to count tokens for
+        model: The model name (default: gpt-4o-mini)
+        
+    Returns:
+        Number of tokens per text, in input order
+    """
+    if not texts:
+        return []
+    return [len(tokens) for tokens in _get_encoding(model).encode_batch(texts)]
 
 
 def count_messages_tokens(messages: List[Dict[str, str]], model: str = "gpt-4o-mini") -> int:
@@ -58,10 +121,7 @@ def count_messages_tokens(messages: List[Dict[str, str]], model: str = "gpt-4o-m
     Returns:
         Approximate number of tokens
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = _get_encoding(model)
     
     num_tokens = 0
     for message in messages:
@@ -92,15 +152,17 @@ def call_llm(
         **kwargs: Additional OpenAI parameters
         
     Returns:
-        Dict with 'content', 'tokens_used', and 'model'
+        Dict with 'content', 'tokens_used', 'completion_tokens', and 'model'
         
     Raises:
         AuthenticationError: If API key is invalid
         RateLimitError: If rate limit exceeded
         OpenAIError: For other OpenAI errors
+        LLMBusyError: If no LLM slot frees up in time
     """
     client = get_openai_client()
     
+    _acquire_llm_slot()
     try:
         response = client.chat.completions.create(
             model=model,
@@ -113,6 +175,7 @@ def call_llm(
         return {
             'content': response.choices[0].message.content,
             'tokens_used': response.usage.total_tokens,
+            'completion_tokens': response.usage.completion_tokens,
             'model': response.model,
             'finish_reason': response.choices[0].finish_reason
         }
@@ -129,6 +192,8 @@ def call_llm(
     except Exception as e:
         logger.error(f"Unexpected error calling LLM: {e}")
         raise
+    finally:
+        _llm_slots.release()
 
 
 def validate_api_key() -> bool:
@@ -150,7 +215,8 @@ def validate_api_key() -> bool:
         return False
 
 
-def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float = 0.7, max_tokens: int = 2000, **kwargs):
+def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float = 0.7, max_tokens: int = 2000,
+               usage: Optional[Dict] = None, **kwargs):
     """
     Call OpenAI API with streaming enabled. Yields text deltas.
     
@@ -159,6 +225,9 @@ def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float =
         model: Model to use
         temperature: Temperature (0.0-2.0)
         max_tokens: Maximum tokens to generate
+        usage: Optional dict to fill with 'tokens_used' and 'completion_tokens'
+            from the provider's final usage chunk, so callers need not
+            re-tokenize the reply
         **kwargs: Additional arguments for the API call
         
     Yields:
@@ -168,9 +237,15 @@ def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float =
         AuthenticationError: If API key is invalid
         RateLimitError: If rate limit is exceeded
         OpenAIError: For other OpenAI errors
+        LLMBusyError: If no LLM slot frees up in time
     """
     client = get_openai_client()
     
+    if usage is not None:
+        kwargs.setdefault('stream_options', {'include_usage': True})
+    
+    _acquire_llm_slot()
+    stream = None
     try:
         stream = client.chat.completions.create(
             model=model,
@@ -182,8 +257,12 @@ def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float =
         )
         
         for chunk in stream:
-            if chunk.choices[0].delta.content is not None:
+            # The usage chunk (last, when requested) has no choices
+            if chunk.choices and chunk.choices[0].delta.content is not None:
                 yield chunk.choices[0].delta.content
+            if usage is not None and getattr(chunk, 'usage', None):
+                usage['tokens_used'] = chunk.usage.total_tokens
+                usage['completion_tokens'] = chunk.usage.completion_tokens
                 
     except AuthenticationError as e:
         logger.error(f"OpenAI authentication failed: {e}")
@@ -197,4 +276,12 @@ def stream_llm(messages: list, model: str = "gpt-4o-mini", temperature: float =
     except Exception as e:
         logger.error(f"Unexpected error streaming LLM: {e}")
         raise
+    finally:
+        # Also runs on GeneratorExit, when the client disconnects mid-stream:
+        # drop the provider connection and hand the slot to the next request
+        try:
+            if stream is not None and hasattr(stream, 'close'):
+                stream.close()
+        finally:
+            _llm_slots.release()
 
@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from chat.models import Document, DocumentChunk
 from chat.chunking import chunk_text
-from chat.embedding_utils import embed_text
+from chat.embedding_utils import embed_texts
+from chat import faiss_index
 
 class Command(BaseCommand):
     help = "Chunk documents and generate embeddings"
@@ -11,10 +13,35 @@ class Command(BaseCommand):
         for doc in docs:
             self.stdout.write(f"Processing {doc.filename}")
             chunks = chunk_text(doc.raw_text)
-            for i, ch in enumerate(chunks):
-                emb = embed_text(ch)
-                DocumentChunk.objects.create(
-                    document=doc, chunk_index=i, text=ch, embedding=emb
+            if not chunks:
+                continue
+            # One batched encode per document; vectors come back unit-length
+            embeddings = embed_texts(chunks)
+            rows = [
+                DocumentChunk(
+                    document=doc, document_filename=doc.filename,
+                    chunk_index=i, text=ch, embedding=emb
                 )
-        self.stdout.write(self.style.SUCCESS("Embedding generation complete."))
+                for i, (ch, emb) in enumerate(zip(chunks, embeddings))
+            ]
+            for row in rows:
+                # bulk_create skips save(), which fills the int8 copy
+                row.prepare_embedding()
+            with transaction.atomic():
+                DocumentChunk.objects.bulk_create(rows, batch_size=500)
+                Document.objects.filter(pk=doc.pk).update(status='ready')
 
+        if faiss_index.is_available():
+            self.stdout.write("Building FAISS index")
+            rows = list(
+                DocumentChunk.objects.filter(embedding__isnull=False)
+                .values_list('id', 'embedding', 'document_id')
+            )
+            faiss_index.rebuild(
+                [chunk_id for chunk_id, _, _ in rows],
+                [embedding for _, embedding, _ in rows],
+                [document_id for _, _, document_id in rows]
+            )
+            # The only writer of the index file; workers load it on startup
+            faiss_index.save()
+        self.stdout.write(self.style.SUCCESS("Embedding generation complete."))
@@ -0,0 +1,23 @@
+from concurrent.futures import wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from chat.tasks import DOCUMENT_PROCESSING_TIMEOUT, requeue_stuck_documents
+
+
+class Command(BaseCommand):
+    help = "Re-process documents left 'processing' by a restarted worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout-minutes', type=int,
+            default=int(DOCUMENT_PROCESSING_TIMEOUT.total_seconds() // 60),
+            help="Treat runs older than this as lost"
+        )
+
+    def handle(self, *args, **options):
+        runs = requeue_stuck_documents(timedelta(minutes=options['timeout_minutes']))
+        # The runs are queued on this process's pool, so wait for them
+        wait(runs)
+        self.stdout.write(self.style.SUCCESS(f"Re-processed {len(runs)} document(s)."))
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-15 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_assistant_message_count(apps, schema_editor):
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    counts = (
+        ChatMessage.objects.filter(session=OuterRef('pk'), role='assistant')
+        .order_by()
+        .values('session')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    ChatSession.objects.update(
+        assistant_message_count=Coalesce(Subquery(counts), Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_document_file_size_document_session'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='assistant_message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_assistant_message_count, migrations.RunPython.noop),
+    ]
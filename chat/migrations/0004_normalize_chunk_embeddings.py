@@ -0,0 +1,30 @@
+from django.db import migrations
+import numpy as np
+
+
+def normalize_chunk_embeddings(apps, schema_editor):
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    rows = DocumentChunk.objects.filter(embedding__isnull=False).only('id', 'embedding')
+    batch = []
+    for chunk in rows.iterator(chunk_size=500):
+        vector = np.asarray(chunk.embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            chunk.embedding = (vector / norm).tolist()
+            batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_chatsession_assistant_message_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_chunk_embeddings, migrations.RunPython.noop),
+    ]
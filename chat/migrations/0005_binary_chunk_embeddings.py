@@ -0,0 +1,57 @@
+from django.db import migrations
+import numpy as np
+
+import chat.models
+
+
+def embeddings_to_binary(apps, schema_editor):
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    rows = DocumentChunk.objects.filter(embedding__isnull=False).only('id', 'embedding')
+    batch = []
+    for chunk in rows.iterator(chunk_size=500):
+        chunk.embedding_bin = np.asarray(chunk.embedding, dtype=np.float32)
+        batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ['embedding_bin'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding_bin'])
+
+
+def embeddings_to_json(apps, schema_editor):
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    rows = DocumentChunk.objects.filter(embedding_bin__isnull=False).only('id', 'embedding_bin')
+    batch = []
+    for chunk in rows.iterator(chunk_size=500):
+        chunk.embedding = chunk.embedding_bin.tolist()
+        batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_normalize_chunk_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_bin',
+            field=chat.models.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(embeddings_to_binary, embeddings_to_json),
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='documentchunk',
+            old_name='embedding_bin',
+            new_name='embedding',
+        ),
+    ]
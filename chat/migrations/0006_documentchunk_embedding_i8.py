@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import numpy as np
+
+
+def quantize_chunk_embeddings(apps, schema_editor):
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    rows = DocumentChunk.objects.filter(embedding__isnull=False).only('id', 'embedding')
+    batch = []
+    for chunk in rows.iterator(chunk_size=500):
+        vector = np.asarray(chunk.embedding, dtype=np.float32)
+        scale = float(np.abs(vector).max()) if vector.size else 0.0
+        codes = np.round(vector * (127.0 / scale)) if scale else np.zeros_like(vector)
+        chunk.embedding_i8 = codes.astype(np.int8).tobytes()
+        chunk.embedding_scale = scale
+        batch.append(chunk)
+        if len(batch) >= 500:
+            DocumentChunk.objects.bulk_update(batch, ['embedding_i8', 'embedding_scale'])
+            batch = []
+    if batch:
+        DocumentChunk.objects.bulk_update(batch, ['embedding_i8', 'embedding_scale'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_binary_chunk_embeddings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_i8',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding_scale',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(quantize_chunk_embeddings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_documentchunk_embedding_i8'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', '-created_at'], name='chat_chatme_session_ff25f5_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_chatmessage_session_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentchunk',
+            index=models.Index(condition=models.Q(('embedding__isnull', False)), fields=['document'], name='chunk_hasemb_doc_ix'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-15 21:02
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_document_filename(apps, schema_editor):
+    Document = apps.get_model('chat', 'Document')
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    DocumentChunk.objects.update(
+        document_filename=Subquery(
+            Document.objects.filter(pk=OuterRef('document_id')).values('filename')[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_documentchunk_embedded_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentchunk',
+            name='document_filename',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_document_filename, migrations.RunPython.noop),
+    ]
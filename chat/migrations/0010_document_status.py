@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-15 23:40
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_chunked_documents_ready(apps, schema_editor):
+    Document = apps.get_model('chat', 'Document')
+    DocumentChunk = apps.get_model('chat', 'DocumentChunk')
+    Document.objects.filter(
+        Exists(DocumentChunk.objects.filter(document_id=OuterRef('pk')))
+    ).update(status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_documentchunk_document_filename'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20),
+        ),
+        migrations.RunPython(mark_chunked_documents_ready, migrations.RunPython.noop),
+    ]
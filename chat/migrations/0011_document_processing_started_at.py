@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 00:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_document_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
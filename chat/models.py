@@ -1,12 +1,43 @@
 from django.db import models
+from django.utils import timezone
+import numpy as np
 import uuid
 
+
+class VectorField(models.BinaryField):
+    """
+    Stores a float32 vector as raw bytes instead of JSON text.
+
+    Accepts any array-like on assignment and reads back as a read-only
+    float32 NumPy array, so rows load without JSON parsing and stack
+    straight into a matrix.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, (list, tuple)):
+            return np.asarray(value, dtype=np.float32)
+        return np.frombuffer(super().to_python(value), dtype=np.float32)
+
+    def get_prep_value(self, value):
+        if value is None:
+            return None
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+
 class ChatSession(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     long_term_summary = models.TextField(blank=True, null=True)
+    assistant_message_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.title or f"Session {self.id}"
@@ -19,31 +50,96 @@ class ChatMessage(models.Model):
     role = models.CharField(max_length=10, choices=ROLE_CHOICES)
     content = models.TextField()
     token_count = models.PositiveIntegerField(default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so a turn saved with bulk_create
+    # can stamp its question before its reply
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [models.Index(fields=["session", "-created_at"])]
 
     def __str__(self):
         return f"{self.role}: {self.content[:40]}"
 
 
 class Document(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),        # stored, not chunked yet
+        ('processing', 'Processing'),  # chunk + embed task queued or running
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     filename = models.CharField(max_length=255)
     raw_text = models.TextField()
     file_size = models.PositiveIntegerField(default=0, help_text="File size in bytes")
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name="documents", null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # When the current processing run started (see chat.tasks.requeue_stuck_documents)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.filename
 
 
+def quantize_int8(vector):
+    """
+    Symmetric per-vector int8 quantization of a unit vector.
+
+    Returns (int8 codes, scale); code * scale / 127 approximates each component.
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(vector).max()) if vector.size else 0.0
+    codes = np.round(vector * (127.0 / scale)) if scale else np.zeros_like(vector)
+    return codes.astype(np.int8), scale
+
+
 class DocumentChunk(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name="chunks")
+    # Copy of document.filename so retrieval results never need the join
+    document_filename = models.CharField(max_length=255, blank=True)
     chunk_index = models.IntegerField()
     text = models.TextField()
-    embedding = models.JSONField(blank=True, null=True)
+    embedding = VectorField(blank=True, null=True)
+    # int8 copy of `embedding` (see prepare_embedding) for the exact-scan prefilter
+    embedding_i8 = models.BinaryField(blank=True, null=True)
+    embedding_scale = models.FloatField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        indexes = [models.Index(fields=["document", "chunk_index"])]
+        indexes = [
+            models.Index(fields=["document", "chunk_index"]),
+            # search() only ever scans chunks that have an embedding
+            models.Index(
+                fields=["document"],
+                condition=models.Q(embedding__isnull=False),
+                name="chunk_hasemb_doc_ix",
+            ),
+        ]
+
+    def prepare_embedding(self):
+        """
+        Normalize the embedding and refresh its int8 copy.
+
+        save() calls this; code that writes chunks with bulk_create must call
+        it on each instance first.
+        """
+        if self.embedding is None:
+            self.embedding_i8 = self.embedding_scale = None
+            return
+        # Store unit vectors so retrieval can score with plain dot products
+        vector = np.asarray(self.embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        if norm:
+            vector = vector / norm
+        self.embedding = vector
+        codes, self.embedding_scale = quantize_int8(vector)
+        self.embedding_i8 = codes.tobytes()
+
+    def save(self, *args, **kwargs):
+        if not self.document_filename:
+            self.document_filename = self.document.filename
+        self.prepare_embedding()
+        super().save(*args, **kwargs)
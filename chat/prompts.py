@@ -1,7 +1,10 @@
 """
 Prompt templates and builders for chat functionality.
 """
-from typing import List, Dict, Optional
+import re
+from itertools import islice
+from typing import List, Dict, Optional, Sequence, Union
+from django.db.models import QuerySet
 from chat.models import ChatMessage
 
 
@@ -10,6 +13,19 @@ Answer questions accurately based on the provided context. If the context doesn'
 contain relevant information, say so clearly. Be concise but comprehensive."""
 
 
+# Prompt injection patterns, matched case-insensitively in one scan
+DANGEROUS_PATTERNS = (
+    'ignore previous instructions',
+    'ignore all previous',
+    'system:',
+    'assistant:',
+    '<|im_start|>',
+    '<|im_end|>',
+    '<|endoftext|>',
+)
+_DANGEROUS_RE = re.compile('|'.join(map(re.escape, DANGEROUS_PATTERNS)), re.IGNORECASE)
+
+
 def sanitize_user_input(message: str) -> str:
     """
     Sanitize user input to prevent prompt injection attacks.
@@ -20,31 +36,11 @@ def sanitize_user_input(message: str) -> str:
     Returns:
         Sanitized message
     """
-    # Remove potential prompt injection patterns (case-insensitive)
-    dangerous_patterns = [
-        'ignore previous instructions',
-        'ignore all previous',
-        'system:',
-        'assistant:',
-        '<|im_start|>',
-        '<|im_end|>',
-        '<|endoftext|>',
-    ]
-    
-    cleaned = message
-    cleaned_lower = cleaned.lower()
-    
-    for pattern in dangerous_patterns:
-        # Find and remove pattern case-insensitively
-        start_idx = 0
-        while True:
-            idx = cleaned_lower.find(pattern, start_idx)
-            if idx == -1:
-                break
-            # Remove the pattern from both strings
-            cleaned = cleaned[:idx] + cleaned[idx + len(pattern):]
-            cleaned_lower = cleaned_lower[:idx] + cleaned_lower[idx + len(pattern):]
-            start_idx = idx
+    # Repeat until nothing matches, so a removal can't splice together a new
+    # pattern (e.g. "sysSYSTEM:tem:"); ordinary messages take a single pass.
+    cleaned, removed = _DANGEROUS_RE.subn('', message)
+    while removed:
+        cleaned, removed = _DANGEROUS_RE.subn('', cleaned)
     
     return cleaned.strip()
 
@@ -62,30 +58,78 @@ def format_retrieved_chunks(chunks: List[Dict]) -> str:
     if not chunks:
         return ""
     
-    formatted_chunks = []
-    for i, chunk in enumerate(chunks, 1):
-        formatted_chunks.append(
-            f"[Source {i}: {chunk.get('document', 'Unknown')} (relevance: {chunk.get('score', 0):.2f})]\n"
-            f"{chunk['text']}"
-        )
+    return "\n\n".join([
+        f"[Source {i}: {chunk.get('document', 'Unknown')} (relevance: {chunk.get('score', 0):.2f})]\n"
+        f"{chunk['text']}"
+        for i, chunk in enumerate(chunks, 1)
+    ])
+
+
+def assemble_messages(
+    system_contents: List[str],
+    history: List[Dict[str, str]],
+    user_content: str,
+    context_contents: Sequence[str] = ()
+) -> List[Dict[str, str]]:
+    """
+    Assemble an OpenAI messages array into a single preallocated list.
+    
+    Messages are ordered from most to least stable: leading system messages,
+    then the append-only history, then per-query context and the question.
+    Consecutive turns therefore share a long identical prefix, which the
+    provider's automatic prompt caching can reuse instead of re-prefilling.
+    
+    Args:
+        system_contents: Contents of the leading system messages, in order
+        history: Conversation history as {role, content} dicts (oldest first)
+        user_content: Content of the final user message
+        context_contents: System messages that change with every query
+            (e.g. retrieved chunks), placed just before the user message
+        
+    Returns:
+        List of message dicts for OpenAI API
+    """
+    messages = [None] * (len(system_contents) + len(history) + len(context_contents) + 1)
+    i = 0
     
-    return "\n\n".join(formatted_chunks)
+    for content in system_contents:
+        messages[i] = {"role": "system", "content": content}
+        i += 1
+    
+    for msg in history:
+        messages[i] = {"role": msg['role'], "content": msg['content']}
+        i += 1
+    
+    for content in context_contents:
+        messages[i] = {"role": "system", "content": content}
+        i += 1
+    
+    messages[i] = {"role": "user", "content": user_content}
+    del messages[i + 1:]
+    
+    return messages
 
 
 def truncate_history(
-    messages: List[ChatMessage], 
+    messages: Union[QuerySet, List[ChatMessage]], 
     max_messages: int = 10
 ) -> List[ChatMessage]:
     """
     Truncate conversation history to most recent messages.
     
+    A QuerySet is limited in the database, so only max_messages rows are
+    fetched however long the session is.
+    
     Args:
-        messages: List of ChatMessage objects
+        messages: ChatMessage QuerySet, or list in chronological order
         max_messages: Maximum number of messages to keep
         
     Returns:
-        Truncated list of messages
+        Truncated list of messages, oldest first
     """
+    if isinstance(messages, QuerySet):
+        return list(messages.order_by('-created_at')[:max_messages])[::-1]
+    
     if len(messages) <= max_messages:
         return messages
     
@@ -96,17 +140,20 @@ def truncate_history(
 def build_chat_prompt(
     user_message: str,
     retrieved_chunks: List[Dict],
-    context_messages: List[ChatMessage],
+    context_messages: Union[QuerySet, List[ChatMessage]],
     summary: Optional[str] = None,
     max_context_messages: int = 10
 ) -> List[Dict[str, str]]:
     """
     Build complete prompt for OpenAI chat completion.
     
+    Retrieved context goes after the history (see assemble_messages), so the
+    system prompt, summary and history stay a cacheable prefix across turns.
+    
     Args:
         user_message: Current user message
         retrieved_chunks: Retrieved document chunks from RAG
-        context_messages: Previous conversation messages
+        context_messages: Previous conversation messages (QuerySet or list)
         summary: Optional long-term conversation summary
         max_context_messages: Maximum context messages to include
         
@@ -124,7 +171,24 @@ def build_chat_prompt(
             "content": f"Previous conversation summary: {summary}"
         })
     
-    # Add retrieved context from RAG
+    # Add recent conversation history, streamed straight into the prompt
+    if isinstance(context_messages, QuerySet):
+        # Only (role, content) pairs are needed, so skip model instantiation
+        recent = list(
+            context_messages.order_by('-created_at')
+            .values_list('role', 'content')[:max_context_messages]
+        )
+        messages.extend(
+            {"role": role, "content": content} for role, content in reversed(recent)
+        )
+    else:
+        start = max(0, len(context_messages) - max_context_messages)
+        messages.extend(
+            {"role": msg.role, "content": msg.content}
+            for msg in islice(context_messages, start, None)
+        )
+    
+    # Add retrieved context from RAG, which changes with every query
     if retrieved_chunks:
         context_text = format_retrieved_chunks(retrieved_chunks)
         messages.append({
@@ -132,14 +196,6 @@ def build_chat_prompt(
             "content": f"Relevant information from knowledge base:\n\n{context_text}"
         })
     
-    # Add recent conversation history
-    truncated_history = truncate_history(context_messages, max_context_messages)
-    for msg in truncated_history:
-        messages.append({
-            "role": msg.role,
-            "content": msg.content
-        })
-    
     # Add current user message (sanitized)
     sanitized_message = sanitize_user_input(user_message)
     messages.append({
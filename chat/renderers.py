@@ -0,0 +1,47 @@
+"""
+DRF JSON renderer backed by orjson.
+
+orjson encodes the large result lists returned by the retrieval and chat
+endpoints several times faster than the stdlib json module, and handles
+UUIDs and NumPy values natively. Anything it cannot encode (datetimes, lazy
+strings, Decimals, ...) goes through DRF's own encoder, so the bytes match
+JSONRenderer's compact output, including its escaping of U+2028/U+2029.
+orjson writes NaN and Infinity as null where DRF's strict mode raises, so
+any output containing null is re-rendered by JSONRenderer, which rejects
+them. orjson is an optional dependency: when it is not installed (or the
+client asks for indented JSON) rendering falls back to JSONRenderer.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+_drf_encoder = JSONEncoder()
+_LINE_SEPARATOR = '\u2028'.encode()
+_PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer that serializes with orjson when it is available."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=_drf_encoder.default,
+                # Keep DRF's "Z" suffix for UTC datetimes
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            # e.g. non-string dict keys, which the stdlib encoder coerces
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'null' in ret:
+            # Possibly a NaN/Infinity that orjson nulled; let DRF decide
+            return super().render(data, accepted_media_type, renderer_context)
+        # Line/paragraph separators are valid JSON but not valid JavaScript
+        return ret.replace(_LINE_SEPARATOR, b'\\u2028').replace(_PARAGRAPH_SEPARATOR, b'\\u2029')
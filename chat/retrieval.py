@@ -1,14 +1,129 @@
 import numpy as np
 from typing import List, Tuple, Optional
-from chat.models import DocumentChunk
-from chat.embedding_utils import embed_text, cosine_similarity
+from chat.models import Document, DocumentChunk, quantize_int8
+from chat import _mmr_numba, faiss_index
+from chat.embedding_utils import (
+    embed_query,
+    cosine_similarity_batch,
+    int8_scores,
+    stack_embeddings,
+    to_unit_matrix,
+)
+
+# Rows fetched per round trip when scanning the int8 chunk codes
+SCAN_CHUNK_SIZE = 5000
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first (ties broken by index).
+    
+    Uses an O(N) argpartition and only sorts the k survivors, instead of
+    sorting all N scores.
+    """
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < len(scores):
+        # k-th best score via an O(N) partition; on ties keep the lowest indices
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[:k - len(above)]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))]
+
+
+def _load_int8_matrix(chunks_query, chunk_size: int = SCAN_CHUNK_SIZE):
+    """
+    Stream (id, int8 codes, scale) rows into preallocated arrays.
+    
+    Rows are fetched chunk_size at a time (a server-side cursor on
+    PostgreSQL), so peak memory is the (N, D) int8 matrix itself rather
+    than a list of N row tuples plus a joined copy. Rows written without
+    prepare_embedding() (bulk_update, raw SQL) have no int8 copy; their
+    stored vectors are quantized here instead of being skipped.
+    
+    Returns:
+        (ids list, int8 (N, D) codes matrix, float32 (N,) scales)
+    """
+    n = chunks_query.count()
+    ids = []
+    missing = []
+    codes = None
+    scales = np.empty(n, dtype=np.float32)
+    rows = chunks_query.values_list('id', 'embedding_i8', 'embedding_scale')
+    for i, (chunk_id, code, scale) in enumerate(rows.iterator(chunk_size=chunk_size)):
+        if i == n:
+            break  # rows added since count(); picked up next search
+        ids.append(chunk_id)
+        if code is None:
+            missing.append(i)
+            continue
+        row = np.frombuffer(code, dtype=np.int8)
+        if codes is None:
+            codes = np.empty((n, len(row)), dtype=np.int8)
+        codes[i] = row
+        scales[i] = scale
+    gone = []
+    if missing:
+        found, vectors = _load_embeddings(chunks_query, [ids[i] for i in missing])
+        vectors = dict(zip(found, to_unit_matrix(vectors))) if found else {}
+        for i in missing:
+            vector = vectors.get(ids[i])
+            if vector is None:
+                gone.append(i)  # deleted since it was read
+                continue
+            if codes is None:
+                codes = np.empty((n, len(vector)), dtype=np.int8)
+            codes[i], scales[i] = quantize_int8(vector)
+    # Rows deleted since count() leave the tail unfilled
+    n = len(ids)
+    codes = codes[:n] if codes is not None else None
+    scales = scales[:n]
+    if gone:
+        keep = np.ones(n, dtype=bool)
+        keep[gone] = False
+        ids = [chunk_id for chunk_id, kept in zip(ids, keep) if kept]
+        codes = codes[keep] if codes is not None else None
+        scales = scales[keep]
+    return ids, codes, scales
+
+
+def _load_embeddings(chunks_query, ids) -> Tuple[list, np.ndarray]:
+    """
+    Stored vectors for `ids`, stacked in that order.
+    
+    Reads (id, embedding) rows only, so scoring a shortlist builds no model
+    instances and never loads chunk text. Chunks deleted since their ids
+    were read (a re-upload, a session reset, a stale FAISS id) are skipped.
+    
+    Returns:
+        (ids that still exist, float32 matrix with one row per such id)
+    """
+    rows = dict(chunks_query.filter(id__in=ids).values_list('id', 'embedding'))
+    found = [chunk_id for chunk_id in ids if chunk_id in rows]
+    return found, stack_embeddings([rows[chunk_id] for chunk_id in found])
+
+
+def _hydrate(chunks_query, ids, scores, indices) -> List[Tuple[float, DocumentChunk]]:
+    """
+    (score, chunk) pairs for ids[i], i in `indices`, in that order.
+    
+    The chunks are fetched in one query; any deleted since they were
+    scored are left out along with their scores.
+    """
+    chunk_map = chunks_query.in_bulk([ids[i] for i in indices])
+    return [(float(scores[i]), chunk_map[ids[i]]) for i in indices if ids[i] in chunk_map]
 
 
 def maximal_marginal_relevance(
     query_embedding: List[float],
     candidate_embeddings: List[List[float]],
     lambda_param: float = 0.5,
-    top_k: int = 3
+    top_k: int = 3,
+    relevance_scores: Optional[np.ndarray] = None,
+    normalized: bool = False
 ) -> List[int]:
     """
     Maximal Marginal Relevance algorithm to select diverse results.
@@ -18,52 +133,57 @@ def maximal_marginal_relevance(
         candidate_embeddings: List of candidate chunk embeddings
         lambda_param: Trade-off between relevance (1.0) and diversity (0.0). Default 0.5.
         top_k: Number of results to return
+        relevance_scores: Optional precomputed query/candidate cosine scores
+        normalized: Candidates are already unit-length (skips renormalizing)
         
     Returns:
         List of indices of selected candidates
     """
-    if not candidate_embeddings:
+    if len(candidate_embeddings) == 0:
         return []
     
-    selected_indices = []
-    candidate_indices = list(range(len(candidate_embeddings)))
+    # Unit-length candidates make pairwise similarity a plain dot product
+    if normalized:
+        candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    else:
+        candidates = to_unit_matrix(candidate_embeddings)
+    
+    # Calculate relevance scores for all candidates in a single GEMV
+    if relevance_scores is None:
+        relevance_scores = cosine_similarity_batch(query_embedding, candidates)
+    relevance_scores = np.asarray(relevance_scores, dtype=np.float32)
     
-    # Calculate relevance scores for all candidates
-    relevance_scores = [
-        cosine_similarity(query_embedding, emb) 
-        for emb in candidate_embeddings
-    ]
+    top_k = min(top_k, len(candidates))
+    if _mmr_numba.is_available():
+        # Fused compiled loop; skips NumPy's per-step dispatch overhead
+        return _mmr_numba.mmr(candidates, relevance_scores, lambda_param, top_k).tolist()
+    
+    relevance_term = lambda_param * relevance_scores
     
     # First selection: most relevant
-    first_idx = max(candidate_indices, key=lambda i: relevance_scores[i])
-    selected_indices.append(first_idx)
-    candidate_indices.remove(first_idx)
+    best_idx = int(np.argmax(relevance_scores))
+    selected_indices = [best_idx]
+    
+    # Running max similarity of every candidate to the selected set. Each
+    # selection adds one row of the candidate similarity matrix (C @ c_best),
+    # so the full N x N matrix is never materialized.
+    max_sim_to_selected = candidates @ candidates[best_idx]
+    mmr_scores = np.empty_like(max_sim_to_selected)
+    selected_mask = np.zeros(len(candidates), dtype=bool)
+    selected_mask[best_idx] = True
     
     # Iteratively select remaining items
-    while len(selected_indices) < top_k and candidate_indices:
-        mmr_scores = []
-        
-        for idx in candidate_indices:
-            # Relevance to query
-            relevance = relevance_scores[idx]
-            
-            # Maximum similarity to already selected items
-            max_sim_to_selected = max([
-                cosine_similarity(
-                    candidate_embeddings[idx],
-                    candidate_embeddings[selected_idx]
-                )
-                for selected_idx in selected_indices
-            ])
-            
-            # MMR score: balance relevance and diversity
-            mmr_score = lambda_param * relevance - (1 - lambda_param) * max_sim_to_selected
-            mmr_scores.append((mmr_score, idx))
+    while len(selected_indices) < top_k:
+        # MMR score: balance relevance and diversity
+        np.multiply(max_sim_to_selected, 1 - lambda_param, out=mmr_scores)
+        np.subtract(relevance_term, mmr_scores, out=mmr_scores)
+        mmr_scores[selected_mask] = -np.inf
         
         # Select item with highest MMR score
-        best_idx = max(mmr_scores, key=lambda x: x[0])[1]
+        best_idx = int(np.argmax(mmr_scores))
         selected_indices.append(best_idx)
-        candidate_indices.remove(best_idx)
+        selected_mask[best_idx] = True
+        np.maximum(max_sim_to_selected, candidates @ candidates[best_idx], out=max_sim_to_selected)
     
     return selected_indices
 
@@ -74,7 +194,9 @@ def search(
     use_mmr: bool = True,
     lambda_param: float = 0.5,
     document_ids: Optional[List[str]] = None,
-    session_id: Optional[str] = None
+    session_id: Optional[str] = None,
+    query_embedding=None,
+    fetch_k: Optional[int] = None
 ) -> List[Tuple[float, DocumentChunk]]:
     """
     Advanced search with MMR and filtering options.
@@ -86,14 +208,27 @@ def search(
         lambda_param: MMR trade-off parameter (0=diversity, 1=relevance)
         document_ids: Optional list of document IDs to filter by
         session_id: Optional session ID to filter documents by session
+        query_embedding: Optional precomputed embedding of `query`
+        fetch_k: Size of the relevance shortlist that is re-scored with
+            full-precision vectors and re-ranked by MMR
+            (default max(4 * top_k, 20))
         
     Returns:
         List of (score, chunk) tuples ordered by relevance/MMR
     """
-    query_emb = embed_text(query)
+    query_emb = query_embedding if query_embedding is not None else embed_query(query)
+    if fetch_k is None:
+        fetch_k = max(4 * top_k, 20)
     
-    # Get all chunks with embeddings
-    chunks_query = DocumentChunk.objects.filter(embedding__isnull=False)
+    # Get all chunks with embeddings; the filename is stored on the chunk, so
+    # results are returned without joining Document (or loading its raw_text).
+    # Vectors are read separately as raw rows, so model instances are only
+    # built for the chunks that are returned, and never carry an embedding.
+    chunks_query = (
+        DocumentChunk.objects
+        .only('document_id', 'document_filename', 'chunk_index', 'text')
+        .filter(embedding__isnull=False)
+    )
     
     # Filter by session if provided
     if session_id:
@@ -103,32 +238,58 @@ def search(
     if document_ids:
         chunks_query = chunks_query.filter(document_id__in=document_ids)
     
-    chunks = list(chunks_query)
+    hits = None
+    if faiss_index.is_available():
+        # Ask the FAISS index for a fetch_k shortlist. It is restricted by
+        # document, which takes one query over documents rather than chunks
+        # and lets the index pick up documents another worker added.
+        documents = Document.objects.all()
+        if session_id:
+            documents = documents.filter(session_id=session_id)
+        if document_ids:
+            documents = documents.filter(id__in=document_ids)
+        candidate_documents = list(documents.values_list('id', flat=True))
+        if not candidate_documents:
+            return []
+        hits = faiss_index.search(query_emb, k=fetch_k, document_ids=candidate_documents)
     
-    if not chunks:
+    if hits is not None:
+        # The index may be quantized, so its scores only pick the shortlist
+        ids = [chunk_id for _, chunk_id in hits]
+    else:
+        # Scan the int8 copies (a quarter of the float32 bytes, and no model
+        # instances) for the shortlist
+        all_ids, codes, scales = _load_int8_matrix(chunks_query)
+        
+        if not all_ids:
+            return []
+        
+        shortlist = _top_k_indices(int8_scores(query_emb, codes, scales), fetch_k)
+        ids = [all_ids[idx] for idx in shortlist]
+    
+    if not ids:
         return []
     
-    # Calculate initial relevance scores
-    scored = [
-        (cosine_similarity(query_emb, chunk.embedding), chunk)
-        for chunk in chunks
-    ]
+    # Re-score the shortlist with the stored vectors; they are unit-length,
+    # so one GEMV yields exact cosine scores
+    ids, embeddings = _load_embeddings(chunks_query, ids)
+    if not ids:
+        return []
+    scores = cosine_similarity_batch(query_emb, embeddings)
     
     if not use_mmr:
         # Simple top-k by relevance
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return scored[:top_k]
+        return _hydrate(chunks_query, ids, scores, _top_k_indices(scores, top_k))
     
-    # Apply MMR
-    embeddings = [chunk.embedding for chunk in chunks]
+    # Apply MMR on the candidate matrix, reusing the relevance scores above
     selected_indices = maximal_marginal_relevance(
         query_embedding=query_emb,
         candidate_embeddings=embeddings,
         lambda_param=lambda_param,
-        top_k=min(top_k, len(chunks))
+        top_k=min(top_k, len(ids)),
+        relevance_scores=scores,
+        normalized=True
     )
     
     # Return selected chunks with their scores
-    results = [(scored[idx][0], chunks[idx]) for idx in selected_indices]
-    
-    return results
+    return _hydrate(chunks_query, ids, scores, selected_indices)
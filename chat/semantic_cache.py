@@ -0,0 +1,130 @@
+"""
+Semantic cache for retrieval results.
+
+Query embeddings are bucketed with random-projection LSH: each table hashes
+a vector to the signs of NUM_BITS random hyperplanes, so near-duplicate
+questions ("what is RAG?" / "what's RAG") usually share a bucket in at
+least one table. A bucket hit is only served when the stored query's cosine
+similarity clears SIMILARITY_THRESHOLD and the other search parameters
+match exactly, so a lookup costs a few small GEMVs instead of a retrieval
+pass.
+
+The cache is per process. It is cleared whenever a Document is saved or
+deleted (see chat.signals), and entries expire after TTL_SECONDS to bound
+staleness from uploads handled by other workers.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Set
+
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.95
+NUM_TABLES = 8
+NUM_BITS = 16
+MAX_ENTRIES = 1024
+TTL_SECONDS = 300
+
+_lock = threading.Lock()
+_planes: Optional[np.ndarray] = None
+_entries: "OrderedDict[int, tuple]" = OrderedDict()
+_buckets: list = [{} for _ in range(NUM_TABLES)]
+_next_id = 0
+
+
+def _unit(embedding) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def _hashes(vec: np.ndarray) -> list:
+    """One bucket key per table: the packed signs of its hyperplane projections."""
+    global _planes
+    if _planes is None or _planes.shape[2] != len(vec):
+        # First use (or a new embedding size): draw fresh hyperplanes
+        _planes = np.random.default_rng(0).standard_normal(
+            (NUM_TABLES, NUM_BITS, len(vec))
+        ).astype(np.float32)
+        _reset()
+    bits = (_planes @ vec) > 0
+    return [np.packbits(row).tobytes() for row in bits]
+
+
+def _reset() -> None:
+    _entries.clear()
+    for bucket in _buckets:
+        bucket.clear()
+
+
+def _evict(entry_id: int) -> None:
+    _, _, _, _, hashes = _entries.pop(entry_id)
+    for bucket, h in zip(_buckets, hashes):
+        ids: Set[int] = bucket.get(h)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del bucket[h]
+
+
+def lookup(params: Hashable, query_embedding) -> Optional[Any]:
+    """
+    Return cached results for a semantically equivalent query, if any.
+
+    Args:
+        params: Hashable tuple of the non-query search parameters
+        query_embedding: Embedding of the incoming query
+
+    Returns:
+        The stored results, or None on a miss
+    """
+    vec = _unit(query_embedding)
+    now = time.monotonic()
+    with _lock:
+        candidates: Set[int] = set()
+        for bucket, h in zip(_buckets, _hashes(vec)):
+            candidates |= bucket.get(h, set())
+        best_id, best_sim = None, SIMILARITY_THRESHOLD
+        for entry_id in candidates:
+            entry_params, entry_vec, _, expires, _ = _entries[entry_id]
+            if expires <= now:
+                _evict(entry_id)
+                continue
+            if entry_params != params:
+                continue
+            sim = float(entry_vec @ vec)
+            if sim >= best_sim:
+                best_id, best_sim = entry_id, sim
+        if best_id is None:
+            return None
+        _entries.move_to_end(best_id)
+        return _entries[best_id][2]
+
+
+def store(params: Hashable, query_embedding, results: Any) -> None:
+    """
+    Cache results for a query, evicting the least recently used entry when full.
+
+    Args:
+        params: Hashable tuple of the non-query search parameters
+        query_embedding: Embedding of the query the results answer
+        results: Value to return for equivalent queries (treated as read-only)
+    """
+    global _next_id
+    vec = _unit(query_embedding)
+    with _lock:
+        hashes = _hashes(vec)
+        entry_id = _next_id
+        _next_id += 1
+        _entries[entry_id] = (params, vec, results, time.monotonic() + TTL_SECONDS, hashes)
+        for bucket, h in zip(_buckets, hashes):
+            bucket.setdefault(h, set()).add(entry_id)
+        while len(_entries) > MAX_ENTRIES:
+            _evict(next(iter(_entries)))
+
+
+def clear() -> None:
+    """Drop every cached result (called when the document set changes)."""
+    with _lock:
+        _reset()
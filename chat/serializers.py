@@ -19,8 +19,8 @@ class DocumentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = Document
-        fields = ['id', 'filename', 'raw_text', 'file_size', 'session', 'chunk_count', 'chunks', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'filename', 'raw_text', 'file_size', 'session', 'status', 'chunk_count', 'chunks', 'created_at']
+        read_only_fields = ['id', 'status', 'created_at']
     
     def get_chunk_count(self, obj):
         return obj.chunks.count()
@@ -74,6 +74,17 @@ class ChatRequestSerializer(serializers.Serializer):
         return value.strip()
 
 
+class RetrieveRequestSerializer(serializers.Serializer):
+    """Serializer for retrieval debug request"""
+    query = serializers.CharField(required=True, max_length=4000)
+    top_k = serializers.IntegerField(default=3, min_value=1, max_value=10)
+    use_mmr = serializers.BooleanField(default=True)
+    lambda_param = serializers.FloatField(default=0.5, min_value=0.0, max_value=1.0)
+    document_ids = serializers.ListField(
+        child=serializers.UUIDField(), required=False, allow_null=True, default=None
+    )
+
+
 class RetrievedChunkSerializer(serializers.Serializer):
     """Serializer for retrieved chunk in response"""
     text = serializers.CharField()
@@ -0,0 +1,63 @@
+"""
+Signal handlers that keep denormalized chat counters, the session context
+cache version, the FAISS index and the semantic result cache in sync.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from chat import faiss_index, semantic_cache
+from chat.llm import count_tokens
+from chat.models import ChatSession, ChatMessage, Document, DocumentChunk
+
+
+@receiver(pre_save, sender=ChatMessage)
+def fill_message_token_count(sender, instance, **kwargs):
+    """Store the message's token count once so history loads never re-tokenize it."""
+    if not instance.token_count and instance.content:
+        instance.token_count = count_tokens(instance.content)
+
+
+@receiver(post_save, sender=ChatMessage)
+def touch_session_on_message(sender, instance, created, **kwargs):
+    """
+    Bump the session's updated_at (which versions chat.context_cache) when a
+    message is stored, and its assistant_message_count for assistant replies.
+    """
+    if not created:
+        return
+    updates = {'updated_at': timezone.now()}
+    if instance.role == 'assistant':
+        updates['assistant_message_count'] = F('assistant_message_count') + 1
+    ChatSession.objects.filter(pk=instance.session_id).update(**updates)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+def clear_semantic_cache(sender, **kwargs):
+    """Drop cached retrieval results once a document is added, changed or removed."""
+    transaction.on_commit(semantic_cache.clear)
+
+
+def index_saved_chunk(sender, instance, **kwargs):
+    """Add or replace the chunk's vector in this process's FAISS index once the row commits."""
+    if instance.embedding is None:
+        return
+    chunk_id, embedding, document_id = instance.id, instance.embedding, instance.document_id
+    transaction.on_commit(lambda: faiss_index.add_chunks([chunk_id], [embedding], [document_id]))
+
+
+def unindex_deleted_chunk(sender, instance, **kwargs):
+    """Drop the chunk's vector from this process's FAISS index once the delete commits."""
+    chunk_id = instance.id
+    transaction.on_commit(lambda: faiss_index.remove_chunks([chunk_id]))
+
+
+# A post_delete receiver stops Django from fast-deleting chunks on cascade: it
+# has to load the rows to send the signals and deletes them in batches, so
+# only connect these when there is an index to maintain.
+if faiss_index.is_available():
+    post_save.connect(index_saved_chunk, sender=DocumentChunk)
+    post_delete.connect(unindex_deleted_chunk, sender=DocumentChunk)
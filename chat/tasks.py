@@ -0,0 +1,207 @@
+"""
+Background tasks that run after the HTTP response has been produced
+(session summaries and document chunking/embedding).
+
+Work is handed to a small in-process thread pool; callers schedule it with
+`transaction.on_commit` so a task never sees uncommitted (or rolled back)
+rows. Each task closes its thread's database connections when it finishes.
+Queued work is not persisted, so a document whose worker restarts
+mid-run stays 'processing' until requeue_stuck_documents picks it up (the
+new run first deletes any chunks the lost one had committed).
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, List
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-tasks')
+
+# A document still 'processing' this long after its run started (or after
+# upload, if no run started) is assumed lost with a restarted worker
+DOCUMENT_PROCESSING_TIMEOUT = timedelta(minutes=30)
+
+
+class _Superseded(Exception):
+    """The document was re-queued while this run was still processing it."""
+
+
+def run_in_background(func: Callable, *args, **kwargs) -> Future:
+    """
+    Run func(*args, **kwargs) on the background pool.
+
+    Exceptions are logged rather than propagated, since nobody awaits
+    the result.
+
+    Args:
+        func: Callable to run
+        *args, **kwargs: Arguments for func
+
+    Returns:
+        Future for the submitted call
+    """
+    def _run():
+        close_old_connections()
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Background task {func.__name__} failed: {e}")
+        finally:
+            close_old_connections()
+
+    return _executor.submit(_run)
+
+
+def summarize_session(session_id: str, model: str = 'gpt-4o-mini') -> None:
+    """
+    Refresh the session's long-term summary if this turn is due for one.
+
+    Args:
+        session_id: Chat session UUID
+        model: LLM model to summarize with
+    """
+    from chat.langgraph.nodes.summarize import summarize
+
+    summarize({'session_id': session_id, 'model': model})
+
+
+def schedule_summary(session_id: str, model: str = 'gpt-4o-mini') -> None:
+    """
+    Queue summarize_session to run once the current transaction commits.
+
+    Args:
+        session_id: Chat session UUID
+        model: LLM model to summarize with
+    """
+    transaction.on_commit(
+        lambda: run_in_background(summarize_session, str(session_id), model)
+    )
+
+
+# Chunks embedded and inserted per round trip while processing a document
+DOCUMENT_CHUNK_BATCH = 512
+
+
+def process_document(document_id: str) -> None:
+    """
+    Chunk and embed a document, then mark it ready (or failed).
+
+    Chunks are produced lazily and embedded a bounded batch at a time, so a
+    large file never holds every chunk's vector at once. Embedding runs
+    outside any transaction; each batch is then inserted in its own short
+    transaction and added to the FAISS index once it commits, so no write
+    lock is held while the model runs. A run that fails or is superseded
+    deletes the chunks it inserted.
+
+    Args:
+        document_id: Document UUID
+    """
+    from itertools import islice
+
+    from chat import faiss_index, semantic_cache
+    from chat.chunking import iter_chunks
+    from chat.embedding_utils import embed_texts
+    from chat.models import Document, DocumentChunk
+
+    # Stamp this run; a run that loses the stamp to a re-queue gives up
+    started = timezone.now()
+    Document.objects.filter(pk=document_id).update(status='processing', processing_started_at=started)
+    document = Document.objects.only('filename', 'raw_text').get(pk=document_id)
+    owned = Document.objects.filter(pk=document_id, processing_started_at=started)
+    # Chunks left behind by an earlier run that died part way
+    DocumentChunk.objects.filter(document_id=document_id).delete()
+    inserted = []
+    try:
+        chunks = iter_chunks(document.raw_text)
+        while batch := list(islice(chunks, DOCUMENT_CHUNK_BATCH)):
+            embeddings = embed_texts(batch)
+            rows = [
+                DocumentChunk(
+                    document=document,
+                    document_filename=document.filename,
+                    chunk_index=len(inserted) + i,
+                    text=chunk,
+                    embedding=embedding
+                )
+                for i, (chunk, embedding) in enumerate(zip(batch, embeddings))
+            ]
+            for row in rows:
+                # bulk_create skips save(), which fills the int8 copy
+                row.prepare_embedding()
+            with transaction.atomic():
+                if not owned.exists():
+                    raise _Superseded
+                DocumentChunk.objects.bulk_create(rows)
+
+                if faiss_index.is_available():
+                    # bulk_create sends no post_save signals, so index the rows here
+                    def _index_chunks(chunk_ids=[row.id for row in rows], embeddings=embeddings):
+                        faiss_index.add_chunks(chunk_ids, embeddings, [document.pk] * len(chunk_ids))
+
+                    transaction.on_commit(_index_chunks)
+            inserted.extend(row.id for row in rows)
+
+        with transaction.atomic():
+            if not owned.update(status='ready'):
+                raise _Superseded
+            # Results cached while the document had no chunks are now stale
+            transaction.on_commit(semantic_cache.clear)
+    except _Superseded:
+        DocumentChunk.objects.filter(id__in=inserted).delete()
+        logger.warning(f"Document {document_id} was re-queued during processing; discarded this run")
+        return
+    except Exception:
+        DocumentChunk.objects.filter(id__in=inserted).delete()
+        owned.update(status='failed')
+        raise
+    logger.info(f"Processed document {document_id}: {len(inserted)} chunk(s)")
+
+
+def requeue_stuck_documents(timeout: timedelta = DOCUMENT_PROCESSING_TIMEOUT) -> List[Future]:
+    """
+    Re-queue documents left 'processing' by a worker that died mid-run.
+
+    Each document is claimed with a conditional UPDATE before it is queued,
+    so concurrent recoveries queue it once. If the original run was only
+    slow, not lost, it finds its stamp replaced and deletes its chunks.
+
+    Args:
+        timeout: How long a run may take before it is presumed lost
+
+    Returns:
+        Futures of the re-queued processing runs
+    """
+    from django.db.models import Q
+
+    from chat.models import Document
+
+    cutoff = timezone.now() - timeout
+    stuck = Document.objects.filter(status='processing').filter(
+        Q(processing_started_at__lt=cutoff)
+        | Q(processing_started_at__isnull=True, created_at__lt=cutoff)
+    ).values_list('pk', 'processing_started_at')
+    requeued = []
+    for document_id, started in list(stuck):
+        claimed = Document.objects.filter(
+            pk=document_id, status='processing', processing_started_at=started
+        ).update(processing_started_at=timezone.now())
+        if claimed:
+            logger.info(f"Re-queued document {document_id}")
+            requeued.append(run_in_background(process_document, str(document_id)))
+    return requeued
+
+
+def schedule_document_processing(document_id: str) -> None:
+    """
+    Queue process_document to run once the current transaction commits.
+
+    Args:
+        document_id: Document UUID
+    """
+    transaction.on_commit(
+        lambda: run_in_background(process_document, str(document_id))
+    )
@@ -1,13 +1,20 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 from openai import OpenAIError, RateLimitError, AuthenticationError
+import io
+import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
-from .models import Document, DocumentChunk, ChatSession, ChatMessage
+from .models import Document, ChatSession, ChatMessage
 from .serializers import (
     DocumentSerializer, 
     DocumentUploadSerializer,
@@ -15,16 +22,31 @@ from .serializers import (
     ChatSessionSerializer,
     ChatMessageSerializer,
     ChatRequestSerializer,
+    RetrieveRequestSerializer,
     ChatResponseSerializer
 )
-from .chunking import chunk_text
-from .embedding_utils import embed_text
+from .embedding_utils import embed_query
 from .retrieval import search
-from .llm import count_tokens
+from .llm import LLMBusyError, count_tokens
 from .langgraph import run_graph
+from .tasks import schedule_document_processing, schedule_summary
+from . import semantic_cache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Characters decoded per read of an upload, so only this much of the raw
+# file is buffered at a time
+UPLOAD_READ_BLOCK = 64 * 1024
+
+# The user message's token count is only needed when it is saved, so it is
+# computed here while the graph runs (tiktoken releases the GIL while encoding).
+_token_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='count-tokens')
+
 
 class DocumentViewSet(viewsets.ModelViewSet):
     queryset = Document.objects.all()
@@ -41,6 +63,7 @@ class DocumentViewSet(viewsets.ModelViewSet):
         """
         Upload a document and optionally auto-process (chunk + embed)
         Binds document to session if session_id provided
+        Processing runs in the background (202 Accepted); poll the status action
         """
         serializer = DocumentUploadSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -60,31 +83,39 @@ class DocumentViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
         
-        # Read file content
+        # Decode a block at a time (newline='' keeps line endings as uploaded).
+        # A bare read() would pull the whole file in as bytes before decoding;
+        # this way only one block of raw bytes is buffered at once. The text
+        # itself is still held whole, since it is stored as raw_text.
+        reader = io.TextIOWrapper(uploaded_file, encoding='utf-8', newline='')
         try:
-            content = uploaded_file.read().decode('utf-8')
+            content = ''.join(iter(lambda: reader.read(UPLOAD_READ_BLOCK), ''))
         except UnicodeDecodeError:
             return Response(
                 {'error': 'File must be UTF-8 encoded text'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        finally:
+            reader.detach()  # leave closing the upload to Django
         
         # Create document with session binding
         with transaction.atomic():
             # Delete previous documents AND chat history for this session (one file per session)
             if session:
-                old_docs = Document.objects.filter(session=session)
-                old_count = old_docs.count()
-                old_docs.delete()  # Cascades to DocumentChunk due to ON DELETE CASCADE
+                # delete() reports per-model row counts, so no COUNT(*) is needed
+                _, deleted = Document.objects.filter(session=session).delete()  # Cascades to DocumentChunk
+                old_count = deleted.get('chat.Document', 0)
                 
                 # Clear chat history too
-                old_messages = ChatMessage.objects.filter(session=session)
-                msg_count = old_messages.count()
-                old_messages.delete()
+                _, deleted = ChatMessage.objects.filter(session=session).delete()
+                msg_count = deleted.get('chat.ChatMessage', 0)
                 
-                # Reset session summary
-                session.session_summary = ""
-                session.save()
+                # Reset session summary and turn counter without re-saving the row
+                ChatSession.objects.filter(pk=session.pk).update(
+                    long_term_summary="",
+                    assistant_message_count=0,
+                    updated_at=timezone.now()
+                )
                 
                 if old_count > 0 or msg_count > 0:
                     logger.info(f"Cleared session {session_id}: {old_count} document(s), {msg_count} message(s)")
@@ -93,32 +124,37 @@ class DocumentViewSet(viewsets.ModelViewSet):
                 filename=uploaded_file.name,
                 raw_text=content,
                 file_size=uploaded_file.size,
-                session=session
+                session=session,
+                status='processing' if auto_process else 'pending'
             )
             
-            chunk_count = 0
             if auto_process:
-                # Chunk and embed
-                chunks = chunk_text(content)
-                for i, chunk in enumerate(chunks):
-                    embedding = embed_text(chunk)
-                    DocumentChunk.objects.create(
-                        document=document,
-                        chunk_index=i,
-                        text=chunk,
-                        embedding=embedding
-                    )
-                    chunk_count += 1
+                # Chunk and embed off the request thread once the row commits;
+                # clients poll GET /api/documents/<id>/status/ until it is ready
+                schedule_document_processing(document.id)
         
         return Response({
             'id': str(document.id),
             'filename': document.filename,
             'file_size': uploaded_file.size,
-            'chunk_count': chunk_count,
+            'status': document.status,
             'auto_processed': auto_process,
             'session_id': str(session.id) if session else None,
             'created_at': document.created_at
-        }, status=status.HTTP_201_CREATED)
+        }, status=status.HTTP_202_ACCEPTED if auto_process else status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'], url_path='status')
+    def processing_status(self, request, pk=None):
+        """
+        Report a document's processing status and how many chunks it has
+        """
+        # Cheap enough to poll: skips loading raw_text
+        document = get_object_or_404(Document.objects.only('status'), pk=pk)
+        return Response({
+            'id': str(document.id),
+            'status': document.status,
+            'chunk_count': document.chunks.count()
+        })
     
     @action(detail=True, methods=['get'])
     def chunks(self, request, pk=None):
@@ -160,90 +196,66 @@ class ChatViewSet(viewsets.ViewSet):
         lambda_param = serializer.validated_data.get('lambda_param', 0.5)
         model = serializer.validated_data.get('model', 'gpt-4o-mini')
         
-        # 2. Validate session exists
-        try:
-            session = ChatSession.objects.get(id=session_id)
-        except ChatSession.DoesNotExist:
+        # 2. Validate session exists (the row itself, summary included, is not needed)
+        if not ChatSession.objects.filter(pk=session_id).exists():
             return Response(
                 {'error': 'Session not found', 'code': 'SESSION_NOT_FOUND'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # 3. Create user message
-        with transaction.atomic():
-            user_msg = ChatMessage.objects.create(
-                session=session,
-                role='user',
-                content=message,
-                token_count=count_tokens(message, model)
+        # 3. Run LangGraph orchestration outside any transaction, so no locks
+        # are held while the LLM responds
+        user_tokens = _token_executor.submit(count_tokens, message, model)
+        # Stamped as asked; history is ordered by created_at alone
+        user_msg = ChatMessage(session_id=session_id, role='user', content=message, created_at=timezone.now())
+        try:
+            result = run_graph(
+                session_id=str(session_id),
+                user_message=message,
+                model=model,
+                top_k=top_k,
+                use_mmr=use_mmr,
+                lambda_param=lambda_param
             )
             
-            # 4. Run LangGraph orchestration
-            try:
-                result = run_graph(
-                    session_id=str(session_id),
-                    user_message=message,
-                    model=model,
-                    top_k=top_k,
-                    use_mmr=use_mmr,
-                    lambda_param=lambda_param
-                )
-                
-                assistant_content = result['content']
-                retrieved_chunks = result['retrieved_chunks']
-                metadata = result['metadata']
-                tokens_used = metadata.get('tokens_used', 0)
-                
-            except AuthenticationError as e:
-                logger.error(f"OpenAI authentication failed: {e}")
-                return Response(
-                    {'error': 'LLM authentication failed. Please check API key configuration.',
-                     'code': 'LLM_AUTH_ERROR'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            except RateLimitError as e:
-                logger.error(f"OpenAI rate limit: {e}")
-                return Response(
-                    {'error': 'Rate limit exceeded. Please try again later.',
-                     'code': 'RATE_LIMIT_EXCEEDED'},
-                    status=status.HTTP_429_TOO_MANY_REQUESTS
-                )
-            except OpenAIError as e:
-                logger.error(f"OpenAI API error: {e}")
-                return Response(
-                    {'error': f'LLM service error: {str(e)}',
-                     'code': 'LLM_SERVICE_ERROR'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            except ValueError as e:
-                logger.error(f"Configuration error: {e}")
-                return Response(
-                    {'error': str(e), 'code': 'CONFIGURATION_ERROR'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-            except Exception as e:
-                logger.error(f"Graph execution error: {e}")
-                return Response(
-                    {'error': 'An unexpected error occurred',
-                     'code': 'INTERNAL_ERROR'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+            assistant_content = result['content']
+            retrieved_chunks = result['retrieved_chunks']
+            metadata = result['metadata']
             
-            # 5. Save assistant message
-            assistant_msg = ChatMessage.objects.create(
-                session=session,
+        except Exception as e:
+            # Keep the question in the history even when the turn fails
+            user_msg.token_count = user_tokens.result()
+            user_msg.save()
+            return _graph_error_response(e)
+        
+        user_msg.token_count = user_tokens.result()
+        with transaction.atomic():
+            # 4. Save both messages in one INSERT (token_count for the reply is
+            # its own length; bulk_create skips the pre_save signal, so count
+            # it here when the LLM did not report usage)
+            assistant_msg = ChatMessage(
+                session_id=session_id,
                 role='assistant',
                 content=assistant_content,
-                token_count=tokens_used
+                token_count=metadata.get('completion_tokens') or count_tokens(assistant_content, model),
+                # Strictly after the question, even on a coarse clock
+                created_at=max(timezone.now(), user_msg.created_at + timedelta(microseconds=1))
+            )
+            ChatMessage.objects.bulk_create([user_msg, assistant_msg])
+            
+            # 5. Touch the session and bump its turn counter in one UPDATE
+            # (the post_save signal does not fire for bulk_create)
+            ChatSession.objects.filter(pk=session_id).update(
+                updated_at=timezone.now(),
+                assistant_message_count=F('assistant_message_count') + 1
             )
             
-            # 6. Update session timestamp
-            session.updated_at = timezone.now()
-            session.save()
+            # 6. Refresh the rolling summary after commit, off the request path
+            schedule_summary(session_id, model)
         
         # 7. Return response
         response_data = {
-            'session_id': str(session.id),
+            'session_id': str(session_id),
             'message_id': str(assistant_msg.id),
             'content': assistant_content,
             'retrieved_chunks': retrieved_chunks,
@@ -254,6 +266,58 @@ class ChatViewSet(viewsets.ViewSet):
         return Response(response_data, status=status.HTTP_200_OK)
 
 
+def _graph_error_response(error: Exception) -> Response:
+    """
+    Map an exception raised by the LangGraph run to an API error response.
+    
+    Args:
+        error: Exception raised by run_graph
+        
+    Returns:
+        Response with an error message and code
+    """
+    if isinstance(error, LLMBusyError):
+        logger.warning(f"LLM busy: {error}")
+        return Response(
+            {'error': 'The assistant is busy. Please try again shortly.',
+             'code': 'LLM_BUSY'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    if isinstance(error, AuthenticationError):
+        logger.error(f"OpenAI authentication failed: {error}")
+        return Response(
+            {'error': 'LLM authentication failed. Please check API key configuration.',
+             'code': 'LLM_AUTH_ERROR'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    if isinstance(error, RateLimitError):
+        logger.error(f"OpenAI rate limit: {error}")
+        return Response(
+            {'error': 'Rate limit exceeded. Please try again later.',
+             'code': 'RATE_LIMIT_EXCEEDED'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+    if isinstance(error, OpenAIError):
+        logger.error(f"OpenAI API error: {error}")
+        return Response(
+            {'error': f'LLM service error: {str(error)}',
+             'code': 'LLM_SERVICE_ERROR'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    if isinstance(error, ValueError):
+        logger.error(f"Configuration error: {error}")
+        return Response(
+            {'error': str(error), 'code': 'CONFIGURATION_ERROR'},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    logger.error(f"Graph execution error: {error}")
+    return Response(
+        {'error': 'An unexpected error occurred',
+         'code': 'INTERNAL_ERROR'},
+        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
 @api_view(['POST'])
 def retrieve_chunks(request):
     """
@@ -267,48 +331,72 @@ def retrieve_chunks(request):
         "document_ids": ["uuid1", "uuid2"]  // optional
     }
     """
-    query = request.data.get('query')
-    if not query:
-        return Response(
-            {'error': 'query parameter is required'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    top_k = request.data.get('top_k', 3)
-    use_mmr = request.data.get('use_mmr', True)
-    lambda_param = request.data.get('lambda_param', 0.5)
-    document_ids = request.data.get('document_ids', None)
+    serializer = RetrieveRequestSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    # Use enhanced search with MMR
-    results = search(
-        query=query,
-        top_k=top_k,
-        use_mmr=use_mmr,
-        lambda_param=lambda_param,
-        document_ids=document_ids
-    )
+    query = serializer.validated_data['query']
+    top_k = serializer.validated_data['top_k']
+    use_mmr = serializer.validated_data['use_mmr']
+    lambda_param = serializer.validated_data['lambda_param']
+    document_ids = serializer.validated_data['document_ids']
     
-    response_data = {
-        'query': query,
-        'top_k': top_k,
-        'use_mmr': use_mmr,
-        'lambda_param': lambda_param,
-        'results': [
+    # Near-duplicate queries with the same parameters reuse earlier results;
+    # the ids are sorted so their order does not split the cache
+    query_embedding = embed_query(query)
+    cache_params = (top_k, use_mmr, lambda_param, tuple(sorted(map(str, document_ids or ()))))
+    results = semantic_cache.lookup(cache_params, query_embedding)
+    if results is None:
+        # Use enhanced search with MMR
+        results = [
             {
                 'score': float(score),
                 'chunk_id': str(chunk.id),
                 'text': chunk.text,
-                'document_id': str(chunk.document.id),
-                'document_filename': chunk.document.filename,
+                'document_id': str(chunk.document_id),
+                'document_filename': chunk.document_filename,
                 'chunk_index': chunk.chunk_index
             }
-            for score, chunk in results
+            for score, chunk in search(
+                query=query,
+                top_k=top_k,
+                use_mmr=use_mmr,
+                lambda_param=lambda_param,
+                document_ids=document_ids,
+                query_embedding=query_embedding
+            )
         ]
+        semantic_cache.store(cache_params, query_embedding, results)
+    
+    response_data = {
+        'query': query,
+        'top_k': top_k,
+        'use_mmr': use_mmr,
+        'lambda_param': lambda_param,
+        'results': results
     }
     
     return Response(response_data)
 
 
+def _sse_event(payload: dict) -> bytes:
+    """
+    Frame a payload as one Server-Sent Events data message.
+    
+    orjson encodes straight to bytes, so per-token deltas skip the str
+    round-trip; without it the stdlib encoder produces the same compact JSON.
+    
+    Args:
+        payload: JSON-serializable event body
+        
+    Returns:
+        The encoded frame, terminated by a blank line
+    """
+    if orjson is not None:
+        return b"data: " + orjson.dumps(payload) + b"\n\n"
+    return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n".encode()
+
+
 @api_view(['POST'])
 def chat_stream(request):
     """
@@ -328,9 +416,6 @@ def chat_stream(request):
     """
     from django.http import StreamingHttpResponse
     from chat.langgraph.graph import run_graph_stream
-    from chat.llm import count_tokens
-    import json
-    import uuid
     
     # Parse request
     session_id = request.data.get('session_id')
@@ -343,17 +428,19 @@ def chat_stream(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    # Check the session and store the question before streaming starts, so a
+    # bad session is a plain 404 and a client that disconnects mid-stream
+    # still leaves its question in the history (as in ChatViewSet.send)
+    try:
+        if not ChatSession.objects.filter(pk=session_id).exists():
+            return Response({'error': 'Session not found'}, status=status.HTTP_404_NOT_FOUND)
+    except ValidationError:
+        return Response({'error': 'Invalid session_id'}, status=status.HTTP_400_BAD_REQUEST)
+    ChatMessage.objects.create(session_id=session_id, role='user', content=message)
+    
     def event_stream():
         """Generate SSE events"""
         try:
-            # Create user message
-            user_msg = ChatMessage.objects.create(
-                session_id=session_id,
-                role='user',
-                content=message,
-                token_count=count_tokens(message, model)
-            )
-            
             # Stream response
             accumulated = ""
             retrieved_chunks = []
@@ -362,38 +449,44 @@ def chat_stream(request):
             for item in run_graph_stream(
                 session_id=session_id,
                 user_message=message,
-                model=model
+                model=model,
+                user_message_saved=True
             ):
                 if isinstance(item, str):
                     # Delta from LLM
                     accumulated += item
-                    yield f"data: {json.dumps({'type': 'delta', 'content': item})}\n\n"
+                    yield _sse_event({'type': 'delta', 'content': item})
                 else:
                     # Final result dict
                     accumulated = item.get('content', accumulated)
                     retrieved_chunks = item.get('retrieved_chunks', [])
                     metadata = item.get('metadata', {})
             
-            # Save assistant message
-            assistant_msg = ChatMessage.objects.create(
-                session_id=session_id,
-                role='assistant',
-                content=accumulated,
-                token_count=count_tokens(accumulated, model)
-            )
-            
-            # Update session timestamp
-            session = ChatSession.objects.get(id=session_id)
-            session.save(update_fields=['updated_at'])
+            with transaction.atomic():
+                # The post_save signal touches the session and bumps its turn
+                # counter. Prefer the provider's completion count over
+                # re-tokenizing the reply.
+                assistant_msg = ChatMessage.objects.create(
+                    session_id=session_id,
+                    role='assistant',
+                    content=accumulated,
+                    token_count=metadata.get('completion_tokens') or count_tokens(accumulated, model)
+                )
+                
+                # Refresh the rolling summary in the background
+                schedule_summary(session_id, model)
             
             # Send done event
-            yield f"data: {json.dumps({'type': 'done', 'message_id': str(assistant_msg.id), 'chunks': len(retrieved_chunks)})}\n\n"
+            yield _sse_event({'type': 'done', 'message_id': str(assistant_msg.id), 'chunks': len(retrieved_chunks)})
             
-        except ChatSession.DoesNotExist:
-            yield f"data: {json.dumps({'type': 'error', 'error': 'Session not found'})}\n\n"
+        except LLMBusyError as e:
+            # The 200 status is already sent, so report busy in the stream
+            logger.warning(f"LLM busy: {e}")
+            yield _sse_event({'type': 'error', 'error': 'The assistant is busy. Please try again shortly.',
+                              'code': 'LLM_BUSY'})
         except Exception as e:
             logger.error(f"Streaming error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield _sse_event({'type': 'error', 'error': str(e)})
     
     response = StreamingHttpResponse(
         event_stream(),
@@ -11,6 +11,23 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from chat._mmr_numba import warm_up
+from chat.tasks import requeue_stuck_documents, run_in_background
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatserver.settings')
 
 application = get_asgi_application()
+
+# Build the routes while the worker boots. The URLconf imports the admin,
+# so it can only be imported once the app registry is ready.
+from chatserver.urls import warm_urlconf  # noqa: E402
+
+warm_urlconf()
+
+# Compile the MMR kernels here rather than in ChatConfig.ready(), which
+# also runs for migrate, test and every other management command
+warm_up()
+
+# Re-queue documents whose processing died with the previous workers (each
+# document is claimed first, so workers booting together queue it once)
+run_in_background(requeue_stuck_documents)
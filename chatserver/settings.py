@@ -1,14 +1,20 @@
 import os
 from pathlib import Path
-from dotenv import load_dotenv
+from types import MappingProxyType
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-# Load environment variables from .env file
-load_dotenv(BASE_DIR / '.env')
+# Load environment variables from .env file (deployments that inject the
+# environment directly can set DJANGO_SKIP_DOTENV=1 to skip the import and
+# file lookup; variables already set always win)
+if os.environ.get("DJANGO_SKIP_DOTENV") != "1":
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
 SECRET_KEY = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 DEBUG = os.environ.get("DEBUG", "1") == "1"
-ALLOWED_HOSTS = os.environ.get("ALLOWED_HOSTS", "localhost,127.0.0.1").split(",")
+# Stray spaces or a trailing comma in the variable would otherwise become
+# host names that never match
+ALLOWED_HOSTS = [h.strip() for h in os.environ.get("ALLOWED_HOSTS", "localhost,127.0.0.1").split(",") if h.strip()]
 
 INSTALLED_APPS = [
     "django.contrib.admin","django.contrib.auth","django.contrib.contenttypes",
@@ -41,12 +47,34 @@ DATABASES = {
         "PASSWORD": "qtec_password",
         "HOST": "localhost",
         "PORT": "5433",
-        "CONN_MAX_AGE": 60,
+        # Keep connections across requests; health checks drop dead ones
+        # before use, so long-lived connections are safe to reuse
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", "600")),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
+# Cache (query embeddings, session context windows). Point REDIS_URL at a
+# Redis server (needs the redis package) to share entries across workers;
+# otherwise each process keeps its own. LocMem's default of 300 entries would
+# cull embeddings after a few hundred distinct questions.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("CACHE_MAX_ENTRIES", "5000"))},
+        }
+    }
 LANGUAGE_CODE = "en-us"; TIME_ZONE = "UTC"; USE_I18N = True; USE_TZ = True
 STATIC_URL = "static/"
 STATIC_ROOT = BASE_DIR / "staticfiles"
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # OpenAI Configuration (API key from environment, never hardcoded)
@@ -54,30 +82,45 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
 # Chat Configuration
-CHAT_CONFIG = {
+# The app config dicts are read-only views, so no code path can mutate
+# settings shared by every request
+CHAT_CONFIG = MappingProxyType({
     "context_messages": int(os.environ.get("CHAT_CONTEXT_MESSAGES", "10")),
     "max_tokens": int(os.environ.get("CHAT_MAX_TOKENS", "2000")),
     "temperature": float(os.environ.get("CHAT_TEMPERATURE", "0.7")),
-}
+})
 
 # RAG Configuration
-RAG_CONFIG = {
+RAG_CONFIG = MappingProxyType({
     "enabled": os.environ.get("RAG_ENABLED", "true").lower() == "true",
     "top_k": int(os.environ.get("RAG_TOP_K", "3")),
     "use_mmr": os.environ.get("RAG_USE_MMR", "true").lower() == "true",
-}
+    "faiss_index_path": os.environ.get("RAG_FAISS_INDEX_PATH", str(BASE_DIR / "var" / "chunks.faiss")),
+    "faiss_index_factory": os.environ.get("RAG_FAISS_INDEX_FACTORY", "auto"),
+})
 
 # Memory Configuration (Phase 7)
-MEMORY_CONFIG = {
+MEMORY_CONFIG = MappingProxyType({
     "max_tokens_context": int(os.environ.get("CHAT_MAX_TOKENS_CONTEXT", "3000")),
     "history_min_turns": int(os.environ.get("CHAT_HISTORY_MIN_TURNS", "6")),
     "summary_interval_turns": int(os.environ.get("SUMMARY_INTERVAL_TURNS", "5")),
+})
+
+# Django REST Framework
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "chat.renderers.ORJSONRenderer",  # falls back to JSONRenderer without orjson
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
-# CORS Configuration (for browser demo)
-CORS_ALLOW_ALL_ORIGINS = True  # For development only
+# CORS Configuration (for browser demo and other browser clients). Only the
+# API needs CORS headers, so other paths skip the middleware's origin checks.
+CORS_URLS_REGEX = r"^/api/.*$"
+CORS_ALLOWED_ORIGINS = [o.strip() for o in os.environ.get("CORS_ALLOWED_ORIGINS", "").split(",") if o.strip()]
+CORS_ALLOW_ALL_ORIGINS = DEBUG and not CORS_ALLOWED_ORIGINS  # any origin in development only
 CORS_ALLOW_CREDENTIALS = True
-CORS_ALLOW_HEADERS = [
+CORS_ALLOW_HEADERS = (
     'accept',
     'accept-encoding',
     'authorization',
@@ -87,4 +130,4 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
-]
+)
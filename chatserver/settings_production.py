@@ -8,12 +8,41 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets readers (history, retrieval) run alongside the writer
+            # instead of blocking on it; IMMEDIATE takes the write lock up
+            # front so concurrent writers wait (up to `timeout` seconds)
+            # rather than failing with "database is locked". That needs every
+            # write transaction to stay well under `timeout`: document
+            # processing embeds outside its transactions and commits each
+            # batch of chunks separately (chat.tasks.process_document).
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+            ),
+        },
     }
 }
 
 # Ensure DEBUG is False in production
 DEBUG = False
 
+# Serve collected static files (admin, browsable API) with hashed names and
+# precompressed variants; run collectstatic first
+MIDDLEWARE = list(MIDDLEWARE)
+MIDDLEWARE.insert(
+    MIDDLEWARE.index("django.middleware.security.SecurityMiddleware") + 1,
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+)
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
+
 # Add your server IP
 ALLOWED_HOSTS = ['191.101.81.150', 'localhost', '127.0.0.1']
 
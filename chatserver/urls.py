@@ -1,34 +1,66 @@
 from django.contrib import admin
-from django.urls import path, include
-from django.http import JsonResponse, HttpResponse
+from django.urls import Resolver404, path, include, resolve
+from django.http import Http404, HttpResponse
 from django.conf import settings
 from django.conf.urls.static import static
-import os
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
+from django.views.decorators.vary import vary_on_headers
+import gzip
+import hashlib
+import re
 
-def health(_): return JsonResponse({"status": "ok"})
+_HEALTH_BODY = b'{"status": "ok"}'
 
-def demo_view(request):
-    """Serve the demo HTML file at root path"""
-    demo_path = os.path.join(settings.BASE_DIR, 'static', 'sse-demo.html')
-    with open(demo_path, 'r') as f:
-        content = f.read()
-    return HttpResponse(content, content_type='text/html')
+def health(_): return HttpResponse(_HEALTH_BODY, content_type="application/json")
 
+# The demo page is static, so it is read once per process rather than per hit
+try:
+    _DEMO_HTML = (settings.BASE_DIR / 'static' / 'sse-demo.html').read_bytes()
+except OSError:
+    _DEMO_HTML = None
+_DEMO_ETAG = hashlib.blake2b(_DEMO_HTML, digest_size=16).hexdigest() if _DEMO_HTML else None
+# Compressed once here instead of on every hit
+_DEMO_GZIP = gzip.compress(_DEMO_HTML, compresslevel=9, mtime=0) if _DEMO_HTML else None
+_ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+
+# Browsers revalidate on each load and get a bodiless 304 while the file is
+# unchanged; the body itself is gzipped when the client accepts it
+@cache_control(no_cache=True)
+@vary_on_headers('Accept-Encoding')
+@etag(lambda request: _DEMO_ETAG)
 def sse_demo(request):
-    """Serve the SSE demo HTML file"""
-    demo_path = os.path.join(settings.BASE_DIR, 'static', 'sse-demo.html')
-    with open(demo_path, 'r') as f:
-        content = f.read()
-    return HttpResponse(content, content_type='text/html')
+    """Serve the SSE demo HTML file (at / and /demo/)"""
+    if _DEMO_HTML is None:
+        raise Http404("Demo page not found")
+    if not _ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        return HttpResponse(_DEMO_HTML, content_type='text/html; charset=utf-8')
+    response = HttpResponse(_DEMO_GZIP, content_type='text/html; charset=utf-8')
+    response['Content-Encoding'] = 'gzip'
+    # Same content, different bytes: the encoded variant gets a weak ETag
+    response['ETag'] = f'W/"{_DEMO_ETAG}"'
+    return response
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("health/", health),
     path("api/", include("chat.urls")),
     path("demo/", sse_demo, name="sse-demo"),
-    path("", demo_view, name="demo"),  # Serve demo at root
+    path("", sse_demo, name="demo"),  # Serve demo at root
 ]
 
 # Serve static files during development
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.BASE_DIR / "static")
+
+
+def warm_urlconf():
+    """
+    Load the URLconf (and with it the views, embedding model and compiled
+    graphs) and compile the top-level routes by resolving the root path once,
+    so the first request does not pay for it.
+    """
+    try:
+        resolve('/')
+    except Resolver404:
+        pass  # the URLconf is loaded all the same